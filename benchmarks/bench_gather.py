@@ -0,0 +1,48 @@
+#
+# Benchmark for `FileGrouping.gather()`.
+#
+# usage:
+#   python benchmarks/bench_gather.py [count ...]
+#
+# Feeds synthetic (non-existing) file paths into each grouping method
+# and reports the time spent, defaults to 1k, 10k and 100k files.
+#
+import os, sys
+import time
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import uvmake
+
+config = {
+    'uvmake': {
+        'header_group_name': 'Header Files',
+        'c_group_name': 'Source Files',
+        'other_files_group_name': 'Other Files',
+    }
+}
+
+def synthetic_filepaths(count :int, files_per_dir=50, dup_every=20):
+    exts = ['.c', '.c', '.c', '.h', '.h', '.lib']
+    filepaths = []
+    for i in range(count):
+        d = path.join('sdk', 'module{}'.format(i // files_per_dir))
+        filepaths.append(path.join(d, 'file{}{}'.format(i, exts[i % len(exts)])))
+        if dup_every and i % dup_every == 0:
+            filepaths.append(filepaths[i // 2])
+    return filepaths
+
+def bench(count :int):
+    filepaths = synthetic_filepaths(count)
+    for grouping_class in (uvmake.FileGroupingNone, uvmake.FileGroupingCByFolder, uvmake.FileGroupingAllByFolder):
+        grouping = grouping_class(config)
+        t = time.perf_counter()
+        grouping.gather(filepaths)
+        t = time.perf_counter() - t
+        print('{:>8} files  {:<24} {:9.3f} s'.format(count, grouping_class.__name__, t))
+
+if __name__ == '__main__':
+    uvmake.logger.setLevel(uvmake.logging.WARNING) # silence duplicate reports
+    counts = [int(n) for n in sys.argv[1:]] or [1000, 10000, 100000]
+    for n in counts:
+        bench(n)
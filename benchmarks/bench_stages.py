@@ -0,0 +1,113 @@
+#
+# Benchmark for every stage of `uvmake.py`, on a synthetic project.
+#
+# usage:
+#   python benchmarks/bench_stages.py [options]    (see `-h`)
+#
+# Generates a source tree and .uvproj/.uvopt templates in a temporary
+# directory, times each stage separately and prints the result as JSON,
+# so that results of different versions can be compared.
+#
+import os, sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+from copy import deepcopy
+from os import path
+
+import synthetic
+from synthetic import uvmake
+
+def timed(stage, runs :int, setup=None) -> dict:
+    '''
+        run `stage(setup())` `runs` times, returns timing in seconds.
+    '''
+    times = []
+    for _ in range(runs):
+        arg = setup() if setup else None
+        t = time.perf_counter()
+        stage(arg)
+        times.append(time.perf_counter() - t)
+    times.sort()
+    return {'best': times[0], 'median': times[len(times) // 2], 'runs': runs}
+
+def bench(root :str, args) -> dict:
+    src_dir = path.join(root, 'src')
+    project_dir = path.join(root, 'Project')
+    filepaths = synthetic.make_source_tree(
+        src_dir, files=args.files, depth=args.depth,
+        ext_mix=synthetic.parse_ext_mix(args.ext_mix) if args.ext_mix else None)
+    duplicates = synthetic.pick_duplicates(filepaths, args.dup_rate)
+    synthetic.make_templates(project_dir, 'bench', filepaths[:args.template_files])
+    config = synthetic.make_config(
+        path.join(root, 'uvmake.yaml'), project_dir, 'bench',
+        source_dirs=[src_dir], source_files=duplicates, max_dir_tree_level=args.depth)
+    config = uvmake._plain(config)
+    uvproj = path.join(project_dir, 'bench.uvproj')
+    uvopt = path.join(project_dir, 'bench.uvopt')
+
+    uvmake.logger.setLevel(uvmake.logging.WARNING)
+    stages = {}
+
+    def _gather(_):
+        _config = deepcopy(config)
+        return uvmake.gather_source_files([src_dir], duplicates, uvmake.make_grouping(_config), _config, project_dir)
+    stages['gather_source_files'] = timed(_gather, args.runs)
+
+    gathered = filepaths + duplicates
+    for grouping_class in (uvmake.FileGroupingNone, uvmake.FileGroupingCByFolder, uvmake.FileGroupingAllByFolder):
+        stages[grouping_class.__name__] = timed(lambda _: grouping_class(config).gather(gathered), args.runs)
+
+    file_groups = _gather(None)
+    file_groups.table.relative_to(project_dir)
+    stages['make_project_xml_groups'] = timed(lambda _: uvmake.make_project_xml_groups(file_groups), args.runs)
+    stages['make_uvoption_xml_groups'] = timed(lambda _: uvmake.make_uvoption_xml_groups(file_groups), args.runs)
+
+    stages['_parse_xml_doc(.uvproj)'] = timed(lambda _: uvmake._parse_xml_doc(uvproj), args.runs)
+    stages['_parse_xml_doc(.uvopt)'] = timed(lambda _: uvmake._parse_xml_doc(uvopt), args.runs)
+
+    _copy = path.join(root, 'copy.uvproj')
+    def _write_setup():
+        shutil.copyfile(uvproj, _copy)
+        return uvmake._parse_xml_doc(uvproj)
+    stages['_write_file(.uvproj)'] = timed(lambda doc: uvmake._write_file(doc, _copy), args.runs, _write_setup)
+
+    stages['reverse_config'] = timed(lambda _config: uvmake.reverse_config(_config, project_dir), args.runs, lambda: deepcopy(config))
+
+    return {
+        'uvmake_version': uvmake.version,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'params': {
+            'files': args.files,
+            'depth': args.depth,
+            'ext_mix': args.ext_mix or synthetic.DEFAULT_EXT_MIX,
+            'dup_rate': args.dup_rate,
+            'duplicates': len(duplicates),
+            'template_files': min(args.template_files, len(filepaths)),
+            },
+        'stages': stages,
+        }
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Time each stage of uvmake on a synthetic project.')
+    parser.add_argument('--files', type=int, default=10000, help='number of source files (default 10000)')
+    parser.add_argument('--depth', type=int, default=3, help='depth of the source tree (default 3)')
+    parser.add_argument('--ext-mix', help='weights of extensions, e.g. "c=6,h=3,a51=1,lib=0.2"')
+    parser.add_argument('--dup-rate', type=float, default=0.05, help='share of files listed twice (default 0.05)')
+    parser.add_argument('--template-files', type=int, default=10000, help='number of files already in the templates (default 10000)')
+    parser.add_argument('--runs', type=int, default=3, help='runs of each stage (default 3)')
+    parser.add_argument('-o', '--output', help='write JSON result to this file instead of stdout')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        result = bench(root, args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+    else:
+        json.dump(result, sys.stdout, indent=2)
+        print()
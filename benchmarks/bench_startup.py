@@ -0,0 +1,60 @@
+#
+# Benchmark for start-up time of `uvmake.py`.
+#
+# usage:
+#   python benchmarks/bench_startup.py [runs]
+#
+# Runs `-v`, `--check` (project up to date) and a full run (`--rescan -K`,
+# with the fingerprint removed so that the project files are made again)
+# on a small generated project, each in a fresh interpreter, and reports
+# the best and median wall time, defaults to 10 runs.
+#
+import os, sys
+import time
+import tempfile
+import subprocess
+from os import path
+
+import synthetic
+from synthetic import uvmake
+
+UVMAKE = uvmake.__file__
+
+def make_project(root :str, files=200):
+    src_dir = path.join(root, 'src')
+    project_dir = path.join(root, 'Project')
+    synthetic.make_source_tree(src_dir, files=files, depth=1)
+    synthetic.make_templates(project_dir, 'bench')
+    config_file = path.join(root, 'uvmake.yaml')
+    synthetic.make_config(config_file, project_dir, 'bench', source_dirs=[src_dir])
+    return config_file
+
+def timed(argv :list, cwd :str, runs :int, setup=None):
+    times = []
+    for _ in range(runs):
+        if setup:
+            setup()
+        t = time.perf_counter()
+        subprocess.run([sys.executable, UVMAKE] + argv, cwd=cwd, check=True, capture_output=True) # a failed run is no sample
+        times.append(time.perf_counter() - t)
+    times.sort()
+    return times[0], times[len(times) // 2]
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    with tempfile.TemporaryDirectory() as root:
+        config_file = make_project(root)
+        subprocess.run([sys.executable, UVMAKE, config_file, '-K'], cwd=root, check=True, capture_output=True)
+
+        def _forget_fingerprint():
+            # `--rescan` doesn't skip the fingerprint, an unchanged project isn't made again
+            if path.exists(config_file + '.fingerprint'):
+                os.remove(config_file + '.fingerprint')
+
+        for name, argv, setup in (
+            ('-v', ['-v'], None),
+            ('--check', [config_file, '--check'], None),
+            ('full run', [config_file, '--rescan', '-K'], _forget_fingerprint),
+            ):
+            best, median = timed(argv, root, runs, setup)
+            print('{:<10} best {:7.1f} ms   median {:7.1f} ms'.format(name, best * 1000, median * 1000))
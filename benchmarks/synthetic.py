@@ -0,0 +1,199 @@
+#
+# Generators of synthetic projects for benchmarks.
+#
+# `make_source_tree()` creates source files, `make_templates()` creates
+# .uvproj/.uvopt templates listing any number of files and `make_config()`
+# a config file for them.
+#
+import os, sys
+import random
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+import uvmake
+
+DEFAULT_EXT_MIX = {'.c': 6, '.h': 3, '.a51': 1, '.lib': 0.2}
+
+def parse_ext_mix(text :str) -> dict:
+    '''
+        'c=6,h=3,a51=1' -> {'.c': 6.0, '.h': 3.0, '.a51': 1.0}
+    '''
+    mix = {}
+    for item in text.split(','):
+        ext, _, weight = item.partition('=')
+        mix['.' + ext.strip().lstrip('.')] = float(weight or 1)
+    return mix
+
+def make_source_tree(root :str, files=1000, depth=3, ext_mix=None, files_per_dir=20, seed=0) -> list:
+    '''
+        create `files` files under `root`, in directories nested 1 to `depth`
+        levels deep. extensions are drawn by weight from `ext_mix`.
+        returns paths of created files.
+    '''
+    rand = random.Random(seed)
+    ext_mix = ext_mix or DEFAULT_EXT_MIX
+    exts, weights = list(ext_mix.keys()), list(ext_mix.values())
+    depth = max(1, depth)
+    ndirs = max(1, -(-files // files_per_dir))
+    fanout = max(2, int(ndirs ** (1 / depth)) + 1)
+
+    def _dirpath(i :int) -> str:
+        parts = []
+        n = i
+        for _ in range(1 + i % depth):
+            n, r = divmod(n, fanout)
+            parts.append('d{}'.format(r))
+        return path.join(root, *parts)
+
+    filepaths = []
+    for i in range(files):
+        d = _dirpath(i // files_per_dir)
+        os.makedirs(d, exist_ok=True)
+        f = path.join(d, 'file{}{}'.format(i, rand.choices(exts, weights)[0]))
+        with open(f, 'w') as fp:
+            fp.write('/* {} */\n'.format(i))
+        filepaths.append(f)
+    return filepaths
+
+def pick_duplicates(filepaths :list, dup_rate=0.05, seed=0) -> list:
+    '''
+        pick about `dup_rate` of `filepaths`, to be listed a second time
+        (as `SourceFiles`) so that they are gathered twice.
+    '''
+    rand = random.Random(seed)
+    return [f for f in filepaths if rand.random() < dup_rate]
+
+_UVPROJ_HEAD = '''\
+<?xml version="1.0" encoding="UTF-8" standalone="no" ?>
+<Project xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="project_proj.xsd">
+
+  <SchemaVersion>1.1</SchemaVersion>
+
+  <Header>### uVision Project, (C) Keil Software</Header>
+
+  <Targets>
+    <Target>
+      <TargetName>Target 1</TargetName>
+      <ToolsetNumber>0x0</ToolsetNumber>
+      <ToolsetName>MCS-51</ToolsetName>
+      <TargetOption>
+        <TargetCommonOption>
+          <Device>AT89C52</Device>
+          <OutputDirectory>.\\Objects\\</OutputDirectory>
+          <OutputName>bench</OutputName>
+          <CreateExecutable>1</CreateExecutable>
+          <CreateLib>0</CreateLib>
+          <CreateHexFile>1</CreateHexFile>
+          <DebugInformation>1</DebugInformation>
+          <BrowseInformation>1</BrowseInformation>
+          <ListingPath></ListingPath>
+        </TargetCommonOption>
+        <Target51>
+          <C51>
+            <VariousControls>
+              <MiscControls></MiscControls>
+              <Define></Define>
+              <Undefine></Undefine>
+              <IncludePath></IncludePath>
+            </VariousControls>
+          </C51>
+        </Target51>
+      </TargetOption>
+      <Groups>
+'''
+
+_UVPROJ_TAIL = '''\
+      </Groups>
+    </Target>
+  </Targets>
+
+</Project>
+'''
+
+_UVOPT_HEAD = '''\
+<?xml version="1.0" encoding="UTF-8" standalone="no" ?>
+<ProjectOpt xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" xsi:noNamespaceSchemaLocation="project_opt.xsd">
+
+  <SchemaVersion>1.0</SchemaVersion>
+
+  <Header>### uVision Project, (C) Keil Software</Header>
+
+  <Extensions>
+    <cExt>*.c</cExt>
+    <aExt>*.s*; *.src; *.a*</aExt>
+  </Extensions>
+
+  <Target>
+    <TargetName>Target 1</TargetName>
+    <ToolsetNumber>0x0</ToolsetNumber>
+    <ToolsetName>MCS-51</ToolsetName>
+    <TargetOption>
+      <CLK51>12000000</CLK51>
+      <OPTTT>
+        <gFlags>1</gFlags>
+      </OPTTT>
+      <Breakpoint>
+        <Bp>
+          <Number>0</Number>
+          <Type>0</Type>
+          <LineNumber>10</LineNumber>
+        </Bp>
+      </Breakpoint>
+    </TargetOption>
+  </Target>
+
+'''
+
+_UVOPT_TAIL = '''\
+</ProjectOpt>
+'''
+
+def make_templates(project_dir :str, project_name :str, filepaths=(), files_per_group=50):
+    '''
+        write `project_name`.uvproj and .uvopt into `project_dir`, listing
+        `filepaths` (relative to `project_dir`) in groups of `files_per_group`.
+    '''
+    os.makedirs(project_dir, exist_ok=True)
+    filepaths = [path.relpath(f, project_dir).replace('/', '\\') for f in filepaths]
+    groups = [filepaths[i:i + files_per_group] for i in range(0, len(filepaths), files_per_group)]
+
+    uvproj = [_UVPROJ_HEAD]
+    uvopt = [_UVOPT_HEAD]
+    for g, group in enumerate(groups, 1):
+        uvproj.append('        <Group>\n          <GroupName>Group {}</GroupName>\n          <Files>\n'.format(g))
+        uvopt.append('  <Group>\n    <GroupName>Group {}</GroupName>\n    <tvExp>1</tvExp>\n    <tvExpOptDlg>0</tvExpOptDlg>\n    <cbSel>0</cbSel>\n    <RteFlg>0</RteFlg>\n'.format(g))
+        for n, f in enumerate(group, 1):
+            name = f.rsplit('\\', 1)[-1]
+            file_type = uvmake.UvFileType.of(name)
+            uvproj.append(
+                '            <File>\n              <FileName>{}</FileName>\n              <FileType>{}</FileType>\n'
+                '              <FilePath>{}</FilePath>\n            </File>\n'.format(name, file_type, f))
+            uvopt.append(
+                '    <File>\n      <GroupNumber>{}</GroupNumber>\n      <FileNumber>{}</FileNumber>\n      <FileType>{}</FileType>\n'
+                '      <tvExp>0</tvExp>\n      <tvExpOptDlg>0</tvExpOptDlg>\n      <bDave2>0</bDave2>\n'
+                '      <PathWithFileName>{}</PathWithFileName>\n      <FilenameWithoutPath>{}</FilenameWithoutPath>\n'
+                '      <RteFlg>0</RteFlg>\n      <bShared>0</bShared>\n    </File>\n'.format(g, n, file_type, f, name))
+        uvproj.append('          </Files>\n        </Group>\n')
+        uvopt.append('  </Group>\n\n')
+    uvproj.append(_UVPROJ_TAIL)
+    uvopt.append(_UVOPT_TAIL)
+
+    for ext, content in (('.uvproj', uvproj), ('.uvopt', uvopt)):
+        with open(path.join(project_dir, project_name + ext), 'w', encoding='UTF-8', newline='\r\n') as f:
+            f.write(''.join(content))
+
+def make_config(config_file :str, project_dir :str, project_name :str, source_dirs=(), source_files=(), max_dir_tree_level=1):
+    '''
+        write a config file made from the template, paths are relative to
+        the directory of `config_file`.
+    '''
+    base = path.dirname(path.abspath(config_file))
+    config = uvmake.get_config_template()
+    config['ProjectDirectory'] = path.relpath(project_dir, base)
+    config['ProjectName'] = project_name
+    config['SourceDirectories'] = [path.relpath(d, base) for d in source_dirs]
+    config['SourceFiles'] = [path.relpath(f, base) for f in source_files]
+    config['ProjectOptions']['IncludePaths'] = []
+    config['uvmake']['max_dir_tree_level'] = max_dir_tree_level
+    uvmake._dump_config(config, config_file)
+    return config
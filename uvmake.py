@@ -1,12 +1,14 @@
 import os, sys
 import re
 import logging
+import ntpath
 import traceback
+import threading
 from collections import OrderedDict
-from pathlib import PurePath
+from functools import lru_cache
 from os import path
-from lxml import etree as et # so painful to type 'etree'
-from ruamel.yaml import YAML
+# `lxml` and `ruamel.yaml` are imported where they are used,
+# so that options like `-v` and `--check` start fast.
 
 logger = logging.getLogger(__name__)
 _handler = logging.StreamHandler()
@@ -14,16 +16,191 @@ _handler.setFormatter(logging.Formatter(fmt=r'[%(levelname)s][%(filename)s:%(lin
 logger.addHandler(_handler)
 logger.setLevel(logging.INFO)
 
-yaml = YAML(typ='rt')
-yaml.default_flow_style = False
-yaml.indent = 4
+version = '0.1' # my version
 
-# config for generating uVision project files.
-config = {}
+def _et():
+    # `lxml.etree`, imported on first use
+    from lxml import etree
+    return etree
 
-args = None
+class UvMakeError(Exception):
+    '''
+        errors reported to the user. raised instead of exiting the process,
+        so that projects can be configured from other programs.
+    '''
 
-version = '0.1' # my version
+class ConfigError(UvMakeError):
+    pass
+
+class ProjectFileError(UvMakeError):
+    pass
+
+class _lines():
+    '''
+        formats a list as indented lines, only when a log record is emitted.
+        e.g. `logger.debug('Files:%s', _lines(filepaths))`
+    '''
+    def __init__(self, items):
+        self.items = items
+
+    def __str__(self):
+        return ''.join('\n  ' + str(item) for item in self.items)
+
+def _peak_memory():
+    # peak resident memory of the process in bytes, None if unknown
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+    except ImportError:
+        pass
+    try:
+        import ctypes
+        from ctypes import wintypes
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [('cb', wintypes.DWORD), ('PageFaultCount', wintypes.DWORD)] + \
+                [(name, ctypes.c_size_t) for name in ('PeakWorkingSetSize', 'WorkingSetSize',
+                    'QuotaPeakPagedPoolUsage', 'QuotaPagedPoolUsage', 'QuotaPeakNonPagedPoolUsage',
+                    'QuotaNonPagedPoolUsage', 'PagefileUsage', 'PeakPagefileUsage')]
+        counters = PROCESS_MEMORY_COUNTERS()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return counters.PeakWorkingSetSize
+    except (ImportError, AttributeError, OSError):
+        pass
+    return None
+
+class Stats():
+    '''
+        phase timers and counters of a run (options `--profile`, `--stats-json`).
+        does nothing until enabled.
+
+        with stats.phase('parse xml'):
+            ...
+        stats.count('bytes written', n)
+    '''
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.phases = OrderedDict()   # name -> [seconds, calls]
+        self.counters = OrderedDict() # name -> int
+        self.peak_memory = None       # of other processes merged in
+
+    def enable(self):
+        self.enabled = True
+
+    def phase(self, name :str):
+        if not self.enabled:
+            return _no_phase
+        return _Phase(self, name)
+
+    def count(self, name :str, n=1):
+        if self.enabled:
+            with _stats_lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, other :dict):
+        # add up stats of another process, as returned by `as_dict()`
+        for name, phase in other['phases'].items():
+            _phase = self.phases.setdefault(name, [0.0, 0])
+            _phase[0] += phase['seconds']
+            _phase[1] += phase['calls']
+        for name, n in other['counters'].items():
+            if name == 'peak memory':
+                self.peak_memory = max(self.peak_memory or 0, n or 0)
+            else:
+                self.count(name, n)
+
+    def as_dict(self) -> dict:
+        counters = OrderedDict(self.counters)
+        counters['peak memory'] = max(_peak_memory() or 0, self.peak_memory or 0) or None
+        return {
+            'phases': OrderedDict((name, {'seconds': p[0], 'calls': p[1]}) for name, p in self.phases.items()),
+            'counters': counters,
+            }
+
+    def report(self):
+        _stats = self.as_dict()
+        logger.info('Phases:')
+        for name, p in _stats['phases'].items():
+            logger.info('  {:<20} {:9.3f} s  ({} calls)'.format(name, p['seconds'], p['calls']))
+        logger.info('Counters:')
+        for name, n in _stats['counters'].items():
+            logger.info('  {:<20} {}'.format(name, 'unknown' if n is None else n))
+
+    def dump_json(self, filepath :str):
+        import json
+        with open(filepath, 'w', encoding='UTF-8') as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+def _enable_stats(profile :bool, profile_out :str, stats_json :str):
+    '''
+        options `--profile`, `--profile-out PSTATS_FILE` and `--stats-json FILE`.
+        stats are reported when the process exits.
+    '''
+    import atexit, time
+    stats.enable()
+    profiler = None
+    if profile_out:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start = time.perf_counter()
+
+    def _report():
+        stats.phases['total'] = [time.perf_counter() - start, 1]
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(profile_out)
+            logger.info('Profile written to: ' + profile_out)
+        if profile or profile_out:
+            stats.report()
+        if stats_json:
+            stats.dump_json(stats_json)
+            logger.info('Stats written to: ' + stats_json)
+    atexit.register(_report)
+
+class _Phase():
+    def __init__(self, stats :Stats, name :str):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        import time
+        self._clock = time.perf_counter
+        self._start = self._clock()
+
+    def __exit__(self, *exc):
+        seconds = self._clock() - self._start
+        with _stats_lock:
+            phase = self.stats.phases.setdefault(self.name, [0.0, 0])
+            phase[0] += seconds
+            phase[1] += 1
+        return False
+
+class _NoPhase():
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        return False
+
+_stats_lock = threading.Lock()
+_no_phase = _NoPhase()
+
+# stats of this process, see `Stats`
+stats = Stats()
+
+def _yaml():
+    # a `YAML` instance is not safe to share between threads
+    from ruamel.yaml import YAML
+    yaml = YAML(typ='rt')
+    yaml.default_flow_style = False
+    yaml.indent = 4
+    return yaml
 
 def shell_interface():
     import argparse
@@ -58,9 +235,61 @@ def shell_interface():
         )
     parser.add_argument(
         '-K', '--no-backup',
-        help='do not backup project files before making changes.',
+        help='do not backup project files before making changes. see option `--restore`.',
+        action='store_true'
+        )
+    parser.add_argument(
+        '--restore',
+        help='restore project files from backup GENERATION, defaults to the latest. current project files are backed up first.',
+        nargs='?',
+        type=int,
+        const=0,
+        metavar='GENERATION'
+        )
+    parser.add_argument(
+        '--check',
+        help='check whether project files are up to date without touching any file. exits with 1 if they are out of date.',
+        action='store_true'
+        )
+    parser.add_argument(
+        '--rescan',
+        help='ignore the scan cache and config snapshot, list every source directory and load the config file again.',
         action='store_true'
         )
+    parser.add_argument(
+        '-W', '--watch',
+        help='keep project files in sync with source files until interrupted, polling every SECONDS (default 1). uses package `watchdog` if installed.',
+        nargs='?',
+        type=float,
+        const=1.0,
+        metavar='SECONDS'
+        )
+    parser.add_argument(
+        '-B', '--batch',
+        help='configure many projects in parallel. each value is a glob pattern of config files, or a manifest file listing them line by line. paths in these config files are relative to the config file.',
+        nargs='+',
+        metavar='MANIFEST_OR_GLOB'
+        )
+    parser.add_argument(
+        '-j', '--jobs',
+        help='number of worker processes for option `--batch`, defaults to the number of CPUs.',
+        type=int
+        )
+    parser.add_argument(
+        '--profile',
+        help='report time spent in each phase and counters of the run.',
+        action='store_true'
+        )
+    parser.add_argument(
+        '--profile-out',
+        help='same as option `--profile`, and dump `cProfile` stats into PSTATS_FILE.',
+        metavar='PSTATS_FILE'
+        )
+    parser.add_argument(
+        '--stats-json',
+        help='write phase timings and counters of the run into FILE as JSON.',
+        metavar='FILE'
+        )
     parser.add_argument(
         '-d', '--debug',
         help='run with debug output',
@@ -115,8 +344,8 @@ def _unindent(s :str, n :int):
     return s
 
 def read_config(config_file :str):
-    config = yaml.load(config_file, Loader=yaml.Loader)
-    return config
+    with open(config_file, encoding='UTF-8') as f:
+        return _yaml().load(f)
 
 def get_config_template():
     _config_yaml = r'''
@@ -164,6 +393,13 @@ def get_config_template():
         UVisionOptions:
             ClockFrequency: 11059200
             remove_breakpoints: True  # 'True' or 'False'
+            # debugger and session state kept in the option file, removed
+            # from every target. smaller option files load faster.
+            remove_watch_windows: False
+            remove_memory_windows: False
+            remove_tracepoints: False
+            # collapse every target in the project tree
+            reset_tree_state: False
 
         uvmake:
             ## Config for uvmake.py
@@ -179,43 +415,244 @@ def get_config_template():
             # ALL_BY_FOLDER
             #   files are grouped according to the folder
             #   they're in, regardless of file type.
-            file_grouping_method:   NONE    # 'NONE', 'C_BY_FOLDER' or 'ALL_BY_FOLDER'
+            # UNITY_BY_FOLDER
+            #   like ALL_BY_FOLDER, but C files of a group are built
+            #   through unity files, `<group>_unity<N>.c` in
+            #   `unity_directory`, each including C files of up to
+            #   `unity_max_bytes`. the C files stay in the group but
+            #   are not built. static names must be unique in a unit.
+            file_grouping_method:   NONE    # 'NONE', 'C_BY_FOLDER', 'ALL_BY_FOLDER' or 'UNITY_BY_FOLDER'
             
             header_group_name:      Header Files   # applies to 'NONE' and 'C_BY_FOLDER'
             c_group_name:           Source Files   # applies to 'NONE' only
             other_files_group_name: Other Files    # applies to all grouping methods
 
+            # applies to 'UNITY_BY_FOLDER' only. the directory is relative
+            # to `ProjectDirectory`, unity files are rewritten only when
+            # their content changes. they are removed again when another
+            # method is used.
+            unity_directory: Unity
+            unity_max_bytes: 65536
+
             # exclude some files if its full path
             # contains any keyword specified here.
+            # directories excluded by any rule are not walked into.
             exclude_keywords:
             - .vscode
 
+            # exclude files and directories matching glob patterns, e.g. 'build',
+            # '*.bak', 'lib/*/test'. patterns with a '/' are matched against the
+            # path relative to the source directory, others against the name.
+            exclude_patterns: []
+
+            # exclude files and directories if a regular expression is found in
+            # their path relative to the source directory ('/' as separator).
+            exclude_regexes: []
+
+            # apply `.gitignore` files found in source directories.
+            use_gitignore: False
+
+            # byte-identical copies of compiled files or libraries gathered
+            # from different places, e.g. a vendor library copied into two
+            # folders. only files of the same size are read, their digests
+            # are cached in `<config-file>.hashcache`.
+            # IGNORE:
+            #   don't look for them.
+            # REPORT:
+            #   warn about them.
+            # EXCLUDE:
+            #   keep only the one gathered first.
+            duplicate_content: IGNORE   # 'IGNORE', 'REPORT' or 'EXCLUDE'
+
+            # which directories of header files found in `SourceDirectories`
+            # are added to `IncludePaths` of the project.
+            # ALL:
+            #   directory of every header file.
+            # USED:
+            #   only directories needed by `#include` directives of source
+            #   files (and of headers they include). directives are cached
+            #   in `<config-file>.includecache`.
+            include_paths: ALL  # 'ALL' or 'USED'
+
+            # with `include_paths: USED`, remove header files
+            # that are never included from file groups.
+            drop_unused_headers: False
+
             # maximum directory tree level to traverse for
             # source files, relative to starting paths.
             # 0 indicates that subdirectories are ignored. 
             max_dir_tree_level: 1
+
+            # number of threads listing directories concurrently.
+            # helps a lot on network-mounted source trees.
+            scan_threads: 8
+
+            # how files in `SourceDirectories` are listed.
+            # WALK:
+            #   list directories on the file system.
+            # GIT_INDEX:
+            #   read the file list from `.git/index` of the repository a
+            #   source directory is in, no git binary is needed. only
+            #   tracked files are listed, build artifacts and untracked
+            #   files are not. tracked source files deleted but not
+            #   staged are left out.
+            #   directories not in a repository are walked.
+            # option `--watch` always walks.
+            source_provider: WALK   # 'WALK' or 'GIT_INDEX'
+
+            # with `source_provider: GIT_INDEX`, also list untracked files,
+            # which walks directories again. enable `use_gitignore` to
+            # leave ignored files out.
+            git_untracked_files: False
+
+            # cache directory listings in `<config-file>.scancache`,
+            # unchanged directories are not listed again.
+            # use command line option `--rescan` to ignore the cache once.
+            scan_cache: True
+
+            # how project files are rewritten.
+            # lxml:
+            #   parse the whole file, and write it back re-indented.
+            # splice:
+            #   stream the file, only the file groups and the options
+            #   above are changed, everything else is copied as is.
+            write_engine: lxml  # 'lxml' or 'splice'
+
+            # number of generations of backups to keep. backups of project
+            # files are kept in `.uvmake-backup` of the project directory,
+            # the same content is stored only once.
+            # use command line option `--restore` to get them back.
+            backup_generations: 10
+
+            # split compiled source files into library projects, which are
+            # built on their own and linked into this project as .LIB files
+            # (in group `lib_group_name`). library projects are
+            # `<ProjectName>_<name>.uvproj/.uvopt`, made from the project
+            # files in `ProjectDirectory`. ones no longer made are removed.
+            # NONE:
+            #   no library projects.
+            # BY_GROUP:
+            #   a library project per file group.
+            # BALANCED:
+            #   `lib_shard_count` library projects of about the same size,
+            #   files are taken in group order.
+            # note: only referenced modules of a library are linked, keep
+            # groups of interrupt functions in this project.
+            lib_shards: NONE   # 'NONE', 'BY_GROUP' or 'BALANCED'
+            lib_shard_count: 4
+            lib_shard_keep: []   # names of groups kept in this project
+            lib_group_name: Libraries
     '''
     _config_yaml = _unindent(_config_yaml, 8)
-    return yaml.load(_config_yaml)
+    return _yaml().load(_config_yaml)
+
+@lru_cache(maxsize=None)
+def _config_keys() -> tuple:
+    # keys every config file must have, parsed from the template only once.
+    return tuple(get_config_template().keys())
+
+def _plain(obj):
+    # convert round-trip YAML objects into plain python objects
+    if isinstance(obj, dict):
+        return {str(k): _plain(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [_plain(v) for v in obj]
+    if isinstance(obj, bool) or obj is None:
+        return obj
+    for _type in (str, int, float):
+        if isinstance(obj, _type):
+            return _type(obj)
+    return obj
+
+def _config_snapshot_key(config_file :str):
+    import hashlib
+    with open(config_file, 'rb') as f:
+        content = f.read()
+    return [version, os.stat(config_file).st_mtime_ns, hashlib.sha1(content).hexdigest()]
+
+def _read_config_snapshot(snapshot_file :str, key :list):
+    import marshal
+    try:
+        with open(snapshot_file, 'rb') as f:
+            snapshot = marshal.load(f)
+        if snapshot['key'] == key:
+            return snapshot['config']
+    except (OSError, EOFError, ValueError, TypeError, KeyError):
+        pass
+    return None
+
+def _write_config_snapshot(snapshot_file :str, key :list, config :dict):
+    import marshal
+    try:
+        with open(snapshot_file + '.tmp', 'wb') as f:
+            marshal.dump({'key': key, 'config': _plain(config)}, f)
+        os.replace(snapshot_file + '.tmp', snapshot_file)
+    except (OSError, ValueError):
+        logger.debug(traceback.format_exc())
+
+_plain_scalar_re = re.compile(r'[A-Za-z0-9_.\\/~$(][^\n\t#]*')
+_special_scalar_re = re.compile(r'(?i)true|false|yes|no|on|off|y|n|null|~|[-+]?(?:\.?[0-9][0-9_.:eE+-]*|\.inf|\.nan)')
+
+def _yaml_scalar(s :str) -> str:
+    # a YAML scalar for string `s`, plain when it reads back the same
+    if _plain_scalar_re.fullmatch(s) and not _special_scalar_re.fullmatch(s) \
+        and not ': ' in s and not s.endswith((' ', ':')):
+        return s
+    if s.isprintable():
+        return "'" + s.replace("'", "''") + "'"
+    import json
+    return json.dumps(s, ensure_ascii=False)
 
 def _dump_config(_config, filepath):
+    # `SourceFiles` may list thousands of files after option `-r`. round-trip
+    # dumping is slow on long sequences, so a placeholder is dumped in their
+    # place and the files are written here. comments are kept.
+    from io import StringIO
+    files = _config.get('SourceFiles')
+    placeholder = '__uvmake_source_files__'
+    if files:
+        from ruamel.yaml.comments import CommentedSeq
+        _seq = CommentedSeq([placeholder])
+        _tail = getattr(files, 'ca', None) and files.ca.items.get(len(files) - 1)
+        if _tail:
+            _seq.ca.items[0] = _tail # comments following the last item
+        _config['SourceFiles'] = _seq
+    try:
+        stream = StringIO()
+        _yaml().dump(_config, stream=stream)
+    finally:
+        if files:
+            _config['SourceFiles'] = files
+    text = stream.getvalue()
+    if files:
+        text = re.sub(r'^([ \t]*-[ \t]+){}$'.format(placeholder),
+            lambda m: '\n'.join(m.group(1) + _yaml_scalar(str(f)) for f in files),
+            text, count=1, flags=re.M)
     with open(filepath, 'w', encoding='UTF-8') as f:
-        yaml.dump(_config, stream=f)
+        f.write(text)
 
-def make_config_template_file():
-    _dump_config(get_config_template(), args.config_file)
-    logger.info('Generated template config file: {}'.format(args.config_file))
+def make_config_template_file(config_file :str):
+    _dump_config(get_config_template(), config_file)
+    logger.info('Generated template config file: {}'.format(config_file))
 
-def load_config():
-    global config
-    logger.debug('Loading config from file: {}'.format(args.config_file))
+def load_config(config_file :str, snapshot_file :str=None, readonly=False) -> dict:
+    '''
+        with `snapshot_file`, the config is loaded from a binary snapshot while
+        the config file is unchanged. such config is made of plain python
+        objects, comments in the config file are not kept.
+        with `readonly`, an outdated snapshot is not updated.
+    '''
+    logger.debug('Loading config from file: %s', config_file)
     try:
-        with open(args.config_file) as f:
-            config = yaml.load(f)
-    except:
-        logger.error('Error: cannot load the config file "{}"'.format(args.config_file))
-        logger.debug(traceback.format_exc())
-        sys.exit(-1)
+        if snapshot_file:
+            key = _config_snapshot_key(config_file)
+            config = _read_config_snapshot(snapshot_file, key)
+            if config is not None:
+                logger.debug('Config loaded from snapshot: %s', snapshot_file)
+                return config
+        config = read_config(config_file)
+    except Exception as e:
+        raise ConfigError('Error: cannot load the config file "{}"'.format(config_file)) from e
     logger.debug('Config loaded successfully')
     #yaml.dump(config, stream=sys.stdout)
 
@@ -228,33 +665,33 @@ def load_config():
             Use command line option `-t` to get a template config file
             in case you don't know what the missing item is for.
             ''', 12)
-        logger.debug('checking config key: {}'.format(k))
+        logger.debug('checking config key: %s', k)
         if not k in d.keys():
-            logger.error(_errmsg.format(k, args.config_file))
-            sys.exit(-1)
-
-    def __check_config(_config :dict, _template :dict):
-        if isinstance(_template, dict):
-            for key in _template:
-                __check_key(_config, key)
-                # uncomment this line for recursive and more conmprehensive check.
-                # __check_config(_config[key], _template[key]) 
-        else: # scalars. e.g. str, int, boolean 
-            return
+            raise ConfigError(_errmsg.format(k, config_file))
 
-    __check_config(config, get_config_template())
+    if not isinstance(config, dict):
+        raise ConfigError('Error: cannot load the config file "{}"'.format(config_file))
+    for k in _config_keys():
+        __check_key(config, k)
     logger.debug('Check done.')
+    if snapshot_file and not readonly:
+        _write_config_snapshot(snapshot_file, key, config)
+    return config
 
-def merge_args(args):
+def merge_args(config :dict, args):
     '''
         merge options in args into config
     '''
     if args.source:
         _source_dirs = [d for d in args.source if _verify_path(d)]
+        if not config['SourceDirectories']:
+            config['SourceDirectories'] = []
         config['SourceDirectories'].extend(_source_dirs)
     if args.include:
         _include_dirs = [d for d in args.include if _verify_path(d)]
-        config['ProjectOptions']['IncludePath'] += ';'+';'.join(_include_dirs)
+        if not config['ProjectOptions'].get('IncludePaths'):
+            config['ProjectOptions']['IncludePaths'] = []
+        config['ProjectOptions']['IncludePaths'].extend(_include_dirs)
     if _verify_path(args.project_dir):
         config['ProjectDirectory'] = args.project_dir
     if _verify_path(args.output_dir):
@@ -277,26 +714,457 @@ def _verify_path(p):
         logger.warning('Invalid path "{}", ignored!'.format(p))
         return False
 
-def _write_file(xml_doc, filepath, backup=True):
-    from shutil import copy
+def _write_file(xml_doc, filepath, output=None):
+    '''
+        write `xml_doc` into `output`, or replace `filepath` with it
+        via a temporary file, so `filepath` is never left half written.
+    '''
+    et = _et()
     if not path.exists(filepath):
         logger.error('File path invalid!')
-        return
-    if backup:
-        backup_name = filepath + '.backup'
-        if path.exists(backup_name):
-            logger.error('Backup file already exists: "{}", Cancelling...'.format(backup_name))
-            return
-        logger.info('Creating backup file for: ' + filepath)
-        copy(filepath, backup_name)
-    logger.info('Updating file: {} ...'.format(filepath))
-    with open(filepath, 'wb') as f:
+        return False
+    logger.info('Updating file: {} ...'.format(_updated_file(filepath, output)))
+    with stats.phase('indent xml'):
         et.indent(xml_doc)
-        docinfo = xml_doc.docinfo
-        xml_doc.write(f, encoding=docinfo.encoding, method="xml", xml_declaration=True, standalone=docinfo.standalone)
+    tmp_name = output or filepath + '.tmp'
+    try:
+        with stats.phase('write'), open(tmp_name, 'wb') as f:
+            docinfo = xml_doc.docinfo
+            xml_doc.write(f, encoding=docinfo.encoding, method="xml", xml_declaration=True, standalone=docinfo.standalone)
+            stats.count('bytes written', f.tell())
+        if not output:
+            os.replace(tmp_name, filepath)
+    except:
+        _remove_quietly(tmp_name)
+        raise
     logger.info('  Update completed.')
+    return True
+
+def _updated_file(filepath :str, output :str) -> str:
+    # the file being made, `output` is a temporary file for it
+    if output and output.endswith('.tmp'):
+        return output[:-len('.tmp')]
+    return output or filepath
+
+def _remove_quietly(filepath :str):
+    try:
+        os.remove(filepath)
+    except OSError:
+        pass
+
+class BackupStore():
+    '''
+        backups of project files, kept in `.uvmake-backup` of the project
+        directory.
+
+        files are stored gzip-compressed under their SHA-256 digest, so the
+        same content is stored once however many generations refer to it.
+        a generation records the files backed up together. only the latest
+        `keep` generations are kept, objects no generation refers to any
+        more are deleted.
+    '''
+    dirname = '.uvmake-backup'
+    version = 1
+
+    def __init__(self, project_dir :str, keep=10):
+        self.project_dir = project_dir
+        self.root = path.join(project_dir, self.dirname)
+        self.keep = max(1, keep)
+        self.generations = [] # [{'id': int, 'time': str, 'files': {name: [digest, size, mtime]}}, ...]
+        self._load()
+
+    def _index_file(self):
+        return path.join(self.root, 'generations.json')
+
+    def _object_file(self, digest :str):
+        return path.join(self.root, 'objects', digest[:2], digest + '.gz')
+
+    def _load(self):
+        import json
+        if not path.exists(self._index_file()):
+            return
+        try:
+            with open(self._index_file(), encoding='UTF-8') as f:
+                index = json.load(f)
+            if index.get('version') == self.version:
+                self.generations = index['generations']
+        except:
+            logger.warning('Ignored broken backup index: "{}"'.format(self._index_file()))
+            logger.debug(traceback.format_exc())
+
+    def _save(self):
+        import json
+        tmp_name = self._index_file() + '.tmp'
+        with open(tmp_name, 'w', encoding='UTF-8') as f:
+            json.dump({'version': self.version, 'generations': self.generations}, f, indent=1)
+        os.replace(tmp_name, self._index_file())
+
+    def _store(self, filepath :str) -> str:
+        import gzip, hashlib
+        with open(filepath, 'rb') as f:
+            content = f.read()
+        digest = hashlib.sha256(content).hexdigest()
+        object_file = self._object_file(digest)
+        if not path.exists(object_file):
+            os.makedirs(path.dirname(object_file), exist_ok=True)
+            with open(object_file + '.tmp', 'wb') as f:
+                f.write(gzip.compress(content, mtime=0))
+            os.replace(object_file + '.tmp', object_file)
+        return digest
+
+    def backup(self, filepaths :list, evict=True):
+        '''
+            back up `filepaths` as a new generation, unless they are the same
+            as in the latest one. returns the id of the generation holding them.
+            without `evict`, old generations are kept until `evict()`.
+        '''
+        import time
+        latest = self.generations[-1] if self.generations else None
+        names = [path.basename(f) for f in filepaths]
+        _stats = [os.stat(f) for f in filepaths]
+        if latest and all(latest['files'].get(n, [None])[1:] == [st.st_size, st.st_mtime_ns] \
+            for n, st in zip(names, _stats)):
+            return latest['id'] # nothing changed, not even read
+
+        os.makedirs(self.root, exist_ok=True)
+        files = {n: [self._store(f), st.st_size, st.st_mtime_ns] for n, f, st in zip(names, filepaths, _stats)}
+        if latest and all(latest['files'].get(n, [None])[0] == files[n][0] for n in names):
+            latest['files'].update(files) # only touched
+            self._save()
+            return latest['id']
+
+        generation = {
+            'id': latest['id'] + 1 if latest else 1,
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'files': files,
+            }
+        self.generations.append(generation)
+        if evict:
+            self.evict()
+        self._save()
+        logger.info('Backed up {} as generation {}'.format(', '.join(names), generation['id']))
+        return generation['id']
+
+    def evict(self):
+        del self.generations[:-self.keep]
+        referred = {f[0] for g in self.generations for f in g['files'].values()}
+        objects = path.join(self.root, 'objects')
+        for d in os.listdir(objects) if path.isdir(objects) else []:
+            for name in os.listdir(path.join(objects, d)):
+                if name.endswith('.gz') and not name[:-3] in referred:
+                    _remove_quietly(path.join(objects, d, name))
+
+    def find(self, generation=None) -> dict:
+        # the generation of id `generation`, the latest by default
+        if not self.generations:
+            raise ProjectFileError('No backup in: "{}"'.format(self.root))
+        if generation is None:
+            return self.generations[-1]
+        _generation = next((g for g in self.generations if g['id'] == generation), None)
+        if _generation is None:
+            raise ProjectFileError('No backup generation {}, available:{}'.format(generation, _lines(
+                ['{}  {}  {}'.format(g['id'], g['time'], ', '.join(g['files'])) for g in self.generations])))
+        return _generation
+
+    def restore(self, generation=None) -> int:
+        '''
+            restore files of `generation` (the latest by default) into the
+            project directory. returns the id of the generation restored.
+        '''
+        import gzip
+        _generation = self.find(generation)
+
+        outputs = []
+        try:
+            for name, (digest, _, _) in _generation['files'].items():
+                output = path.join(self.project_dir, name + '.tmp')
+                outputs.append(output)
+                with gzip.open(self._object_file(digest), 'rb') as src, open(output, 'wb') as dst:
+                    dst.write(src.read())
+            for name, output in zip(_generation['files'], outputs):
+                os.replace(output, path.join(self.project_dir, name))
+                logger.info('Restored: {} (generation {}, {})'.format(name, _generation['id'], _generation['time']))
+        finally:
+            for output in outputs:
+                _remove_quietly(output)
+        return _generation['id']
+
+class ProjectLock():
+    '''
+        advisory lock on a project directory, held by one uvmake process
+        at a time while it writes the project files. others wait for it.
+
+        with ProjectLock(project_dir):
+            ...
+    '''
+    filename = '.uvmake.lock'
+
+    def __init__(self, project_dir :str, poll=0.2):
+        self.filepath = path.join(project_dir, self.filename)
+        self.poll = poll
+        self._file = None
+
+    def _try_lock(self) -> bool:
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_NBLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def __enter__(self):
+        import time
+        self._file = open(self.filepath, 'a+b')
+        if not self._try_lock():
+            logger.info('Waiting for another uvmake on: ' + path.dirname(self.filepath))
+            while not self._try_lock():
+                time.sleep(self.poll)
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            if os.name == 'nt':
+                import msvcrt
+                self._file.seek(0)
+                msvcrt.locking(self._file.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        finally:
+            self._file.close()
+            self._file = None
+        return False
+
+_xml_tag_re = re.compile(rb'<[^>"\']*(?:(?:"[^"]*"|\'[^\']*\')[^>"\']*)*>')
+_xml_name_re = re.compile(rb'</?([^\s/>]+)')
+_xml_encoding_re = re.compile(rb'encoding=["\']([^"\']+)')
+
+def _iter_xml_tokens(f, chunk_size=1 << 16):
+    '''
+        split the XML document in binary stream `f` into tokens, reading it
+        in chunks. yields (kind, data, tag name), with kind in 'text', 'start',
+        'empty' (self-closing tag), 'end' and 'misc' (declaration, comment, ...).
+        joining all `data` gives back the document byte for byte.
+    '''
+    _misc_ends = ((b'<!--', b'-->'), (b'<![CDATA[', b']]>'), (b'<?', b'?>'), (b'<!', b'>'))
+    buf, pos, eof = b'', 0, False
+
+    def __more():
+        nonlocal buf, pos, eof
+        buf = buf[pos:]
+        pos = 0
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buf += chunk
+
+    while True:
+        lt = buf.find(b'<', pos)
+        if lt < 0:
+            if eof:
+                if pos < len(buf):
+                    yield ('text', buf[pos:], None)
+                return
+            __more()
+            continue
+        if lt > pos:
+            yield ('text', buf[pos:lt], None)
+            pos = lt
+        if len(buf) - pos < 9 and not eof:
+            __more()
+            continue
+        for _begin, _end in _misc_ends:
+            if buf.startswith(_begin, pos):
+                end = buf.find(_end, pos + len(_begin))
+                end = end + len(_end) if end >= 0 else -1
+                kind = 'misc'
+                break
+        else:
+            m = _xml_tag_re.match(buf, pos)
+            end = m.end() if m else -1
+            kind = 'end' if buf.startswith(b'</', pos) else 'start'
+        if end < 0:
+            if eof:
+                raise ValueError('Unterminated markup at end of document')
+            __more()
+            continue
+        data = buf[pos:end]
+        pos = end
+        if kind == 'misc':
+            yield (kind, data, None)
+            continue
+        if kind == 'start' and data.endswith(b'/>'):
+            kind = 'empty'
+        yield (kind, data, _xml_name_re.match(data).group(1).decode())
+
+def _xml_fragment(elem, indent :str, newline :str, encoding :str) -> bytes:
+    et = _et()
+    # Keil never writes self-closing tags
+    for node in elem.iter():
+        if node.text is None and not len(node):
+            node.text = ''
+    et.indent(elem, space='  ')
+    lines = et.tostring(elem, encoding=str).split('\n')
+    return (newline + indent).join(lines).encode(encoding, 'xmlcharrefreplace')
+
+def _splice_xml(src, dst, patches :dict=None, replace :dict=None, remove :dict=None, append :dict=None, normalize :dict=None, removed :dict=None):
+    '''
+        copy the XML document in binary stream `src` to `dst`, changing only
+        the elements addressed by absolute paths (e.g. '/Project/Targets'):
+            patches:   {path: text}, sets text of the first matching element.
+            replace:   {path: element}, replaces the first matching element.
+            remove:    {path: count}, removes up to `count` matching elements, all for None.
+            append:    {path: [element, ...]}, appends to children of the first matching element.
+            normalize: {path: text}, sets text of every matching element, if any.
+        everything else, formatting included, is copied through byte for byte.
+        bytes dropped by `remove` and `normalize` are added up into `removed`
+        as {path: bytes}.
+    '''
+    from xml.sax.saxutils import escape
+    patches = dict(patches or {})
+    replace = dict(replace or {})
+    remove = dict(remove or {})
+    append = dict(append or {})
+    normalize = normalize or {}
+    removed = {} if removed is None else removed
+
+    encoding, newline = 'UTF-8', None
+    stack = []
+    held = b''        # pending whitespace, dropped along with a removed element
+    separators = {}   # parent path -> whitespace before its first removed child
+    skip = 0          # depth inside an element being dropped
+    keep_end = False  # write the end tag of the element being dropped
+    counted = None    # path in `removed` the dropped bytes are added to
+
+    def __path(name=None):
+        return '/' + '/'.join(stack + [name] if name else stack)
+
+    def __indent_of(ws :bytes):
+        return ws.decode(encoding).rsplit('\n', 1)[-1]
+
+    for kind, data, name in _iter_xml_tokens(src):
+        if skip:
+            if kind == 'start':
+                skip += 1
+            elif kind == 'end':
+                skip -= 1
+                if not skip:
+                    stack.pop()
+                    if keep_end:
+                        dst.write(data)
+                        continue
+            if counted:
+                removed[counted] += len(data)
+            continue
+
+        if kind == 'text' and data.isspace():
+            # line breaks of written parts follow the first one of the document
+            if newline is None and b'\n' in data:
+                newline = '\r\n' if b'\r\n' in data else '\n'
+            held += data
+            continue
 
-def _parse_xml_doc(xml_file):
+        if kind == 'misc' and data.startswith(b'<?xml'):
+            m = _xml_encoding_re.search(data)
+            if m:
+                encoding = m.group(1).decode()
+
+        if kind in ('start', 'empty'):
+            p = __path(name)
+            if remove.get(p, 0) != 0:
+                if remove[p] is not None:
+                    remove[p] -= 1
+                separators.setdefault(__path(), held)
+                removed[p] = removed.get(p, 0) + len(held) + len(data)
+                held = b''
+                if kind == 'start':
+                    stack.append(name)
+                    skip, keep_end, counted = 1, False, p
+                continue
+            if p in replace:
+                dst.write(held)
+                dst.write(_xml_fragment(replace.pop(p), __indent_of(held), newline or '\n', encoding))
+                held = b''
+                if kind == 'start':
+                    stack.append(name)
+                    skip, keep_end, counted = 1, False, None
+                continue
+            if p in patches or p in normalize:
+                _normal = not p in patches
+                value = escape(normalize[p] if _normal else patches.pop(p)).encode(encoding, 'xmlcharrefreplace')
+                dst.write(held)
+                held = b''
+                if kind == 'empty':
+                    _data = data[:-2].rstrip() + b'>' + value + b'</' + name.encode() + b'>'
+                    if _normal:
+                        removed[p] = removed.get(p, 0) + len(data) - len(_data)
+                    dst.write(_data)
+                else:
+                    dst.write(data + value)
+                    stack.append(name)
+                    skip, keep_end, counted = 1, True, p if _normal else None
+                    if _normal:
+                        removed[p] = removed.get(p, 0) - len(value)
+                continue
+            dst.write(held + data)
+            held = b''
+            if kind == 'start':
+                stack.append(name)
+            continue
+
+        if kind == 'end':
+            p = __path()
+            if p in append:
+                sep = separators.get(p) or ((newline or '\n') + '  ' * len(stack)).encode(encoding)
+                indent = __indent_of(sep)
+                for elem in append.pop(p):
+                    dst.write(sep)
+                    dst.write(_xml_fragment(elem, indent, newline or '\n', encoding))
+            stack.pop()
+
+        dst.write(held + data)
+        held = b''
+
+    dst.write(held)
+    _missing = [*patches, *replace, *append]
+    if _missing:
+        raise ValueError('Elements not found: ' + ', '.join(_missing))
+
+def _splice_file(filepath, output=None, source :bytes=None, **changes):
+    '''
+        rewrite `filepath` with `_splice_xml()` into `output`, or replace
+        `filepath` via a temporary file. `source` is the content of `filepath`
+        if it's already read.
+    '''
+    if not path.exists(filepath):
+        logger.error('File path invalid!')
+        return False
+    logger.info('Updating file: {} ...'.format(_updated_file(filepath, output)))
+    tmp_name = output or filepath + '.tmp'
+    try:
+        import io
+        with stats.phase('write'), \
+            (io.BytesIO(source) if source is not None else open(filepath, 'rb')) as src, \
+            open(tmp_name, 'wb') as dst:
+            _splice_xml(src, dst, **changes)
+            stats.count('bytes written', dst.tell())
+        if not output:
+            os.replace(tmp_name, filepath)
+    except:
+        _remove_quietly(tmp_name)
+        raise
+    logger.info('  Update completed.')
+    return True
+
+def _parse_xml_doc(xml_file, data :bytes=None):
+    '''
+        parse `xml_file`, or `data` read from it.
+    '''
+    et = _et()
     def __patch_xml(doc):
         # prevent creation of self-closing tags
         for node in doc.xpath('//*[not(text())]'):
@@ -304,158 +1172,250 @@ def _parse_xml_doc(xml_file):
             
     logger.info('Parsing project file: ' + xml_file)
     try:
-        doc = et.parse(xml_file)
-        __patch_xml(doc)
+        with stats.phase('parse xml'):
+            doc = et.parse(xml_file) if data is None else et.fromstring(data).getroottree()
+            __patch_xml(doc)
     except Exception as e:
         logger.error('XML parsing failed!')
         raise
     logger.info('  Parsing completed.')
     return doc
 
-def _resolve_project_related_options(root):
+def _project_option_patches(config :dict) -> OrderedDict:
+    '''
+        returns {element path: text} for options in `ProjectOptions`
+    '''
     _opts = dict()
+    _patches = OrderedDict()
 
     def __has_value(name):
         return _opts.get(name) is not None
 
     def __set_val(xp, value):
-        root.xpath(xp)[0].text = str(value)
+        _patches[xp] = str(value)
 
-    try:
-        _opts = config['ProjectOptions']
-        _base = '/Project/Targets/Target/'
+    _opts = config['ProjectOptions']
+    _base = '/Project/Targets/Target/'
 
-        if __has_value('TargetName'):
-            __set_val(_base + 'TargetName', _opts['TargetName'])
-        
-        if __has_value('IncludePaths') :
-            if not isinstance(_opts['IncludePaths'], list) :
-                logger.warning('the type of `IncludePaths` should be a list, got {}'.format(type(_opts['IncludePaths'])))
-            else:
-                __set_val(_base + 'TargetOption/Target51/C51/VariousControls/IncludePath', ';'.join(_opts['IncludePaths']))
+    if __has_value('TargetName'):
+        __set_val(_base + 'TargetName', _opts['TargetName'])
+    
+    if __has_value('IncludePaths') :
+        if not isinstance(_opts['IncludePaths'], list) :
+            logger.warning('the type of `IncludePaths` should be a list, got {}'.format(type(_opts['IncludePaths'])))
+        else:
+            __set_val(_base + 'TargetOption/Target51/C51/VariousControls/IncludePath', ';'.join(_opts['IncludePaths']))
 
-        if __has_value('OutputName'):
-            __set_val(_base + 'TargetOption/TargetCommonOption/OutputName', _opts['OutputName'])
-        
-        if __has_value('OutputDirectory'):
-            __set_val(_base + 'TargetOption/TargetCommonOption/OutputDirectory', path.join('.\\', path.normpath(_opts['OutputDirectory']) + '\\'))
-        
-        if __has_value('CreateExecutableOrLib'):
-            if _opts['CreateExecutableOrLib'] == 'lib':
-                __set_val(_base + 'TargetOption/TargetCommonOption/CreateExecutable', 0)
-                __set_val(_base + 'TargetOption/TargetCommonOption/CreateLib', 1)
-            elif _opts['CreateExecutableOrLib'] == 'exe':
-                __set_val(_base + 'TargetOption/TargetCommonOption/CreateExecutable', 1)
-                __set_val(_base + 'TargetOption/TargetCommonOption/CreateLib', 0)
-            else:
-                logger.warning('Invalid value for `CreateExecutableOrLib`: {}'.format(_opts['CreateExecutableOrLib']))
+    if __has_value('OutputName'):
+        __set_val(_base + 'TargetOption/TargetCommonOption/OutputName', _opts['OutputName'])
+    
+    if __has_value('OutputDirectory'):
+        __set_val(_base + 'TargetOption/TargetCommonOption/OutputDirectory', ntpath.join('.\\', ntpath.normpath(_opts['OutputDirectory']) + '\\'))
+    
+    if __has_value('CreateExecutableOrLib'):
+        if _opts['CreateExecutableOrLib'] == 'lib':
+            __set_val(_base + 'TargetOption/TargetCommonOption/CreateExecutable', 0)
+            __set_val(_base + 'TargetOption/TargetCommonOption/CreateLib', 1)
+        elif _opts['CreateExecutableOrLib'] == 'exe':
+            __set_val(_base + 'TargetOption/TargetCommonOption/CreateExecutable', 1)
+            __set_val(_base + 'TargetOption/TargetCommonOption/CreateLib', 0)
+        else:
+            logger.warning('Invalid value for `CreateExecutableOrLib`: {}'.format(_opts['CreateExecutableOrLib']))
+
+    if __has_value('CreateHexFile'):
+        __set_val(_base + 'TargetOption/TargetCommonOption/CreateHexFile', '1' if _opts['CreateHexFile'] else '0')
+    return _patches
 
-        if __has_value('CreateHexFile'):
-            __set_val(_base + 'TargetOption/TargetCommonOption/CreateHexFile', '1' if _opts['CreateHexFile'] else '0')
+_uvopt_slimmed_sections = OrderedDict([
+    ('remove_breakpoints', ['Breakpoint']),
+    ('remove_watch_windows', ['WatchWindow1', 'WatchWindow2']),
+    ('remove_memory_windows', ['MemoryWindow1', 'MemoryWindow2', 'MemoryWindow3', 'MemoryWindow4']),
+    ('remove_tracepoints', ['Tracepoint']),
+    ])
+
+def _uvopt_option_patches(config :dict):
+    '''
+        returns ({element path: text}, {element path: number of elements to remove},
+        {element path: text of every matching element}) for options in `UVisionOptions`.
+        removed and normalized elements are the ones of every `Target`.
+    '''
+    _patches = OrderedDict()
+    _removals = OrderedDict()
+    _normals = OrderedDict()
+
+    if config['ProjectOptions'].get('TargetName') is not None:
+        _patches['/ProjectOpt/Target/TargetName'] = str(config['ProjectOptions']['TargetName'])
+
+    _opts =  config['UVisionOptions']
+    if _opts.get('ClockFrequency') is not None:
+        _patches['/ProjectOpt/Target/TargetOption/CLK51'] = str(_opts['ClockFrequency'])
+    for option, sections in _uvopt_slimmed_sections.items():
+        if _opts.get(option) == True:
+            for name in sections:
+                _removals['/ProjectOpt/Target/TargetOption/' + name] = None
+    if _opts.get('reset_tree_state') == True:
+        _normals['/ProjectOpt/Target/TargetOption/OPTFL/tvExp'] = '0'
+        _normals['/ProjectOpt/Target/TargetOption/OPTFL/tvExpOptDlg'] = '0'
+    return _patches, _removals, _normals
+
+def _resolve_project_related_options(root, config :dict):
+    try:
+        for xp, value in _project_option_patches(config).items():
+            root.xpath(xp)[0].text = value
     except:
         logger.error('Failed on resolving related options in project file!')
         raise
 
-def _resolve_uvopt_related_options(root):
-
-    def __set_val(xp, value):
-        root.xpath(xp)[0].text = value
-
+def _resolve_uvopt_related_options(root, config :dict) -> int:
+    '''
+        returns number of bytes saved by removed and normalized elements.
+    '''
+    et = _et()
     try:
-        if config['ProjectOptions'].get('TargetName') is not None:
-            __set_val('/ProjectOpt/Target/TargetName', config['ProjectOptions']['TargetName'])
-
-        _opts =  config['UVisionOptions']
-        if _opts.get('ClockFrequency') is not None:
-            __set_val('/ProjectOpt/Target/TargetOption/CLK51', str(_opts['ClockFrequency']))
-        if _opts.get('remove_breakpoints') == True:
-            _node = root.xpath('/ProjectOpt/Target/TargetOption')[0]
-            if _node.xpath('Breakpoint'):
-                _node.remove(_node.xpath('Breakpoint')[0])
+        saved = 0
+        _patches, _removals, _normals = _uvopt_option_patches(config)
+        for xp, value in _patches.items():
+            root.xpath(xp)[0].text = value
+        for xp, count in _removals.items():
+            for _node in root.xpath(xp)[:count]:
+                saved += len(et.tostring(_node, method='c14n', exclusive=True)) + len((_node.tail or '').encode('UTF-8'))
+                _node.getparent().remove(_node)
+        for xp, value in _normals.items():
+            for _node in root.xpath(xp):
+                saved += len((_node.text or '').encode('UTF-8')) - len(value)
+                _node.text = value
+        return saved
     except:
         logger.error('Failed on resolving related options in uVision option file!')
         raise
 
 def _create_SubElement(parent, tag, attrib={}, text=None, nsmap=None, **_extra):
+    et = _et()
     result = et.SubElement(parent, tag, attrib, nsmap, **_extra)
     result.text = text
     return result
  
-def make_project_xml_groups(file_groups :dict) -> et._Element:
+def make_project_xml_groups(file_groups :'FileGroups') -> 'et._Element':
+    '''
+        file paths are taken from `relpath` of the records (see `FileGroups.from_dict()`).
+    '''
+    et = _et()
+    file_groups = FileGroups.from_dict(file_groups)
     groups = et.Element('Groups')
 
-    def _make_xml_group_node(group_name :str, filepaths :list):
+    def _make_xml_group_node(group_name :str, records :list):
         group = et.Element('Group')
         _create_SubElement(group, 'GroupName', text=group_name)
         files_node = _create_SubElement(group, 'Files')
-        for f in filepaths:
+        for r in records:
             file_node = _create_SubElement(files_node, 'File')
-            file_name = path.split(f)[1]
-            _create_SubElement(file_node, 'FileName', text=file_name)
-            _create_SubElement(file_node, 'FileType', text=str(UvFileType.of(file_name)))
-            _create_SubElement(file_node, 'FilePath', text=f)
+            _create_SubElement(file_node, 'FileName', text=r.name)
+            _create_SubElement(file_node, 'FileType', text=str(r.type))
+            _create_SubElement(file_node, 'FilePath', text=r.relpath)
         return group
 
-    for group_name in file_groups:
-        group = _make_xml_group_node(group_name, file_groups[group_name])
-        groups.append(group)
+    with stats.phase('build xml'):
+        for group_name in file_groups:
+            group = _make_xml_group_node(group_name, file_groups.records(group_name))
+            groups.append(group)
+    if stats.enabled:
+        stats.count('xml nodes created', sum(1 for _ in groups.iter()))
 
     return groups
 
-def make_uvoption_xml_groups(file_groups :dict) -> list:
+def make_uvoption_xml_groups(file_groups :'FileGroups') -> list:
+    '''
+        file paths are taken from `relpath` of the records (see `FileGroups.from_dict()`).
+    '''
+    et = _et()
+    file_groups = FileGroups.from_dict(file_groups)
     groups = []
 
-    def _make_xml_group_node(group_name :str, group_number :int, filepaths :list):
+    def _make_xml_group_node(group_name :str, group_number :int, records :list):
         group = et.Element('Group')
         _create_SubElement(group, 'GroupName', text='0')
         _create_SubElement(group, 'tvExp', text='0')
         _create_SubElement(group, 'tvExpOptDlg', text='0')
         _create_SubElement(group, 'cbSel', text='0')
         _create_SubElement(group, 'RteFlg', text='0')
-        for i in range(len(filepaths)):
-            f = filepaths[i]
+        _group_number = str(group_number)
+        for i, r in enumerate(records, 1):
             file_node = _create_SubElement(group, 'File')
-            _create_SubElement(file_node, 'GroupNumber', text=str(group_number))
-            _create_SubElement(file_node, 'FileNumber', text=str(i+1))
-            file_name = path.split(f)[1]
-            _create_SubElement(file_node, 'FileType', text=str(UvFileType.of(file_name)))
+            _create_SubElement(file_node, 'GroupNumber', text=_group_number)
+            _create_SubElement(file_node, 'FileNumber', text=str(i))
+            _create_SubElement(file_node, 'FileType', text=str(r.type))
             _create_SubElement(file_node, 'tvExp', text='0')
             _create_SubElement(file_node, 'tvExpOptDlg', text='0')
             _create_SubElement(file_node, 'bDave2', text='0')
-            _create_SubElement(file_node, 'PathWithFileName', text=f)
-            _create_SubElement(file_node, 'FilenameWithoutPath', text=file_name)
+            _create_SubElement(file_node, 'PathWithFileName', text=r.relpath)
+            _create_SubElement(file_node, 'FilenameWithoutPath', text=r.name)
             _create_SubElement(file_node, 'RteFlg', text='0')
             _create_SubElement(file_node, 'bShared', text='0')
         return group
 
-    i = 1
-    for group_name in file_groups:
-        group = _make_xml_group_node(group_name, i, file_groups[group_name])
-        groups.append(group)
-        i += 1 
+    with stats.phase('build xml'):
+        i = 1
+        for group_name in file_groups:
+            group = _make_xml_group_node(group_name, i, file_groups.records(group_name))
+            groups.append(group)
+            i += 1 
+    if stats.enabled:
+        stats.count('xml nodes created', sum(1 for g in groups for _ in g.iter()))
 
     return groups
 
-def make_project_file(template_pro_file, file_groups :dict, backup=True):
+def make_project_file(template_pro_file, file_groups :dict, config :dict, output=None, preloaded=None):
+    '''
+        update `template_pro_file`, or write the updated file into `output`.
+        `preloaded` is the template loaded by `TemplatePreload`, if any.
+        the project files are backed up by `make_project()`.
+    '''
     if not path.exists(template_pro_file):
-        logger.error('Project file "{}" not found!'.format(template_pro_file))
-        raise
-    doc = _parse_xml_doc(template_pro_file)
+        raise ProjectFileError('Project file "{}" not found!'.format(template_pro_file))
+    if config['uvmake'].get('write_engine') == 'splice':
+        return _splice_file(
+            template_pro_file,
+            output=output,
+            source=preloaded,
+            patches=_project_option_patches(config),
+            replace={'/Project/Targets/Target/Groups': make_project_xml_groups(file_groups)}
+            )
+    doc = preloaded if preloaded is not None else _parse_xml_doc(template_pro_file)
     root = doc.getroot()
 
     new_groups = make_project_xml_groups(file_groups)
     _node = root.xpath('/Project/Targets/Target')[0]
     _node.replace(_node.xpath('Groups')[0], new_groups)
 
-    _resolve_project_related_options(root)
+    _resolve_project_related_options(root, config)
     
-    _write_file(doc, template_pro_file, backup=backup)
+    return _write_file(doc, template_pro_file, output=output)
 
-def make_uv_option_file(template_uvopt_file, file_groups :dict, backup=True):
+def make_uv_option_file(template_uvopt_file, file_groups :dict, config :dict, output=None, preloaded=None):
+    '''
+        update `template_uvopt_file`, or write the updated file into `output`.
+        `preloaded` is the template loaded by `TemplatePreload`, if any.
+        the project files are backed up by `make_project()`.
+    '''
     if not path.exists(template_uvopt_file):
-        logger.error('Project file "{}" not found!'.format(template_uvopt_file))
-        raise
-    doc = _parse_xml_doc(template_uvopt_file)
+        raise ProjectFileError('Project file "{}" not found!'.format(template_uvopt_file))
+    if config['uvmake'].get('write_engine') == 'splice':
+        _patches, _removals, _normals = _uvopt_option_patches(config)
+        removed = dict()
+        done = _splice_file(
+            template_uvopt_file,
+            output=output,
+            source=preloaded,
+            patches=_patches,
+            remove=OrderedDict([*_removals.items(), ('/ProjectOpt/Group', None)]),
+            normalize=_normals,
+            removed=removed,
+            append={'/ProjectOpt': make_uvoption_xml_groups(file_groups)}
+            )
+        if done:
+            _report_slimming(sum(n for p, n in removed.items() if p != '/ProjectOpt/Group'))
+        return done
+    doc = preloaded if preloaded is not None else _parse_xml_doc(template_uvopt_file)
     root = doc.getroot()
 
     for g in root.xpath('/ProjectOpt/Group'):
@@ -464,124 +1424,524 @@ def make_uv_option_file(template_uvopt_file, file_groups :dict, backup=True):
     for g in make_uvoption_xml_groups(file_groups):
         root.xpath('/ProjectOpt')[0].append(g)
     
-    _resolve_uvopt_related_options(root)
+    saved = _resolve_uvopt_related_options(root, config)
 
-    _write_file(doc, template_uvopt_file, backup=backup)
+    done = _write_file(doc, template_uvopt_file, output=output)
+    if done:
+        _report_slimming(saved)
+    return done
 
-def make_project(project_dir :str, project_name :str, file_groups :dict, backup=True):
-    from copy import deepcopy
-    _file_groups = deepcopy(file_groups)
-    # make file path in `_file_groups` relative to `project_dir`
-    for g in _file_groups:
-        _file_groups[g] = \
-            sorted( # sort by filename
-                [path.relpath(f, start=project_dir) for f in _file_groups[g]],
-                key=path.basename
-                )
-    
-    logger.info('Entering project directory: ' + project_dir)
-    old_dir = os.getcwd()
-    os.chdir(project_dir)
+def _report_slimming(saved :int):
+    if saved:
+        logger.info('  Option file slimmed by {} bytes.'.format(saved))
+        stats.count('option file bytes saved', saved)
+
+class TemplatePreload():
+    '''
+        parses (or just reads, with `write_engine: splice`) and validates
+        project files on background threads, so that it's done while source
+        files are gathered. `get()` hands the result to `make_project()`,
+        `cancel()` drops it when project files turn out to be up to date.
+
+        the threads are daemon threads, so the process never waits for a
+        template that is not used.
+    '''
+    _required = {'.uvproj': '/Project/Targets/Target/Groups', '.uvopt': '/ProjectOpt/Target'}
+
+    def __init__(self, filepaths :list, config :dict):
+        from concurrent.futures import Future
+        self.engine = config['uvmake'].get('write_engine')
+        self._loading = dict()
+        for f in filepaths:
+            future = self._loading[f] = Future()
+            threading.Thread(target=self._run, args=(f, future), daemon=True).start()
 
+    def _run(self, filepath :str, future):
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(self._load(filepath))
+        except BaseException as e:
+            future.set_exception(e)
+
+    def cancel(self):
+        for future in self._loading.values():
+            future.cancel()
+        self._loading.clear()
+
+    def _stat(self, filepath :str):
+        st = os.stat(filepath)
+        return st.st_mtime_ns, st.st_size
+
+    def _load(self, filepath :str):
+        # returns (stat, content, error)
+        try:
+            stat = self._stat(filepath)
+        except OSError:
+            return None, None, None # reported by `make_project()`
+        required = self._required.get(path.splitext(filepath)[1].lower())
+        try:
+            if self.engine == 'splice':
+                import io
+                with open(filepath, 'rb') as f:
+                    content = f.read()
+                found = not required or _extract_xml(io.BytesIO(content), {'required': required}, name=filepath)['required'] is not None
+            else:
+                content = _parse_xml_doc(filepath)
+                found = not required or bool(content.xpath(required))
+        except Exception as e:
+            return stat, None, ProjectFileError('Invalid project file "{}": {}'.format(filepath, e))
+        if not found:
+            return stat, None, ProjectFileError('Invalid project file "{}": {} not found'.format(filepath, required))
+        return stat, content, None
+
+    def get(self, filepath :str):
+        '''
+            returns the loaded content of `filepath`, or None if it's not
+            loaded or has changed since. raises `ProjectFileError` if it's invalid.
+        '''
+        loading = self._loading.pop(filepath, None)
+        if loading is None:
+            return None
+        stat, content, error = loading.result()
+        try:
+            if stat is None or stat != self._stat(filepath):
+                return None
+        except OSError:
+            return None
+        if error:
+            raise error
+        return content
+
+def _file_digest(filepath :str) -> str:
+    import hashlib
+    h = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+def project_fingerprint(file_groups :'FileGroups', project_files :list, config :dict) -> str:
+    '''
+        fingerprint of everything resolved into the project files:
+        `file_groups` (by `relpath`), `ProjectOptions`, `UVisionOptions`
+        and the current content of `project_files`.
+    '''
+    import hashlib, json
+    file_groups = FileGroups.from_dict(file_groups)
+    _groups = OrderedDict((g, [r.relpath for r in file_groups.records(g)]) for g in file_groups)
+    _inputs = json.dumps(
+        [version, _groups, config['ProjectOptions'], config['UVisionOptions']],
+        sort_keys=True, default=str
+        )
+    h = hashlib.sha256(_inputs.encode('UTF-8'))
+    for f in project_files:
+        h.update(_file_digest(f).encode() if path.exists(f) else b'-')
+    return h.hexdigest()
+
+def _read_fingerprint(filepath :str):
     try:
-        make_project_file(
-            template_pro_file=project_name + '.uvproj',
-            file_groups = _file_groups,
-            backup=backup
-            )
-        make_uv_option_file(
-            template_uvopt_file=project_name + '.uvopt',
-            file_groups = _file_groups,
-            backup=backup
-            )
+        with open(filepath, encoding='UTF-8') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def _write_fingerprint(filepath :str, fingerprint :str):
+    try:
+        with open(filepath, 'w', encoding='UTF-8') as f:
+            f.write(fingerprint + '\n')
+    except OSError as e:
+        logger.warning('Cannot record fingerprint in "{}": {}'.format(filepath, e))
+
+def _stale_libraries(project_name :str, fingerprint_file :str, libraries=()) -> list:
+    # library projects made by `make_sharded_project()` before and not in
+    # `libraries`, known by their fingerprint files
+    if not fingerprint_file:
+        return []
+    prefix = path.basename(fingerprint_file) + '.'
+    try:
+        names = os.listdir(path.dirname(fingerprint_file))
+    except OSError:
+        return []
+    names = [n[len(prefix):] for n in names if n.startswith(prefix + project_name + '_')]
+    return sorted(n for n in names if re.fullmatch(r'\w+', n) and not n in libraries)
+
+def _remove_libraries(project_dir :str, names :list, fingerprint_file :str):
+    for name in names:
+        logger.info('Removing library project: ' + name)
+        for ext in ('.uvproj', '.uvopt'):
+            _remove_quietly(path.join(project_dir, name + ext))
+        _remove_quietly('{}.{}'.format(fingerprint_file, name))
+
+def make_project(project_dir :str, project_name :str, file_groups :'FileGroups', config :dict, backup=True, fingerprint_file=None, check=False, preload :TemplatePreload=None, lock=True, libraries=()) -> bool:
+    '''
+        returns True if the project files are up to date, or updated.
+
+        when the fingerprint of this run matches the one recorded in
+        `fingerprint_file`, project files are left untouched.
+        with `check`, nothing is written at all. with `backup`, project files
+        are backed up in `BackupStore` first.
+
+        both project files are made concurrently into temporary files, which
+        replace the project files only when both are complete. that is done
+        under `ProjectLock` (unless `lock` is False, when the caller holds it),
+        so concurrent runs on a project take turns.
+        templates loaded by `preload` are used unless they have changed since.
+
+        library projects made by `make_sharded_project()` before, other than
+        `libraries`, are removed (backed up first with `backup`).
+    '''
+    file_groups = FileGroups.from_dict(file_groups)
+    # make file paths relative to `project_dir`
+    file_groups.table.relative_to(project_dir)
+    _file_groups = file_groups.sorted_by_name()
+
+    logger.info('Configuring project in directory: ' + project_dir)
+    uvproj_file = path.join(project_dir, project_name + '.uvproj')
+    uvopt_file = path.join(project_dir, project_name + '.uvopt')
+    project_files = [uvproj_file, uvopt_file]
+    up_to_date = False
+    try:
+        if check:
+            fingerprint = project_fingerprint(_file_groups, project_files, config)
+            up_to_date = bool(fingerprint_file) and fingerprint == _read_fingerprint(fingerprint_file)
+            logger.info('Project files are up to date.' if up_to_date else 'Project files are out of date.')
+            stale = _stale_libraries(project_name, fingerprint_file, libraries)
+            for name in stale:
+                logger.info('Library project "{}" is not used any more.'.format(name))
+            return up_to_date and not stale
+        if not path.isdir(project_dir):
+            raise ProjectFileError('Project directory not exist: "{}"'.format(project_dir))
+        from contextlib import nullcontext
+        with ProjectLock(project_dir) if lock else nullcontext():
+            stale = _stale_libraries(project_name, fingerprint_file, libraries)
+            fingerprint = project_fingerprint(_file_groups, project_files, config)
+            up_to_date = bool(fingerprint_file) and fingerprint == _read_fingerprint(fingerprint_file)
+            if backup and (stale or not up_to_date):
+                _stale_files = [path.join(project_dir, name + ext) for name in stale for ext in ('.uvproj', '.uvopt')]
+                BackupStore(project_dir, config['uvmake'].get('backup_generations', 10)).backup(
+                    ([] if up_to_date else project_files) + [f for f in _stale_files if path.exists(f)])
+            _remove_libraries(project_dir, stale, fingerprint_file)
+            if up_to_date:
+                logger.info('Project files are up to date.')
+                return True
+            up_to_date = _make_project_files(uvproj_file, uvopt_file, _file_groups, config, preload=preload)
+            if up_to_date and fingerprint_file:
+                _write_fingerprint(fingerprint_file, project_fingerprint(_file_groups, project_files, config))
+    except UvMakeError:
+        raise
     except Exception as e:
-        logger.error('Error occurred, cancelling...')
-        logger.debug(traceback.format_exc())
-        sys.exit(-1)
-    
-    logger.info('Leaving project directory:  ' + project_dir)
-    os.chdir(old_dir)
+        raise ProjectFileError('Error occurred, cancelling... ({})'.format(e)) from e
+    return up_to_date
+
+def _make_project_files(uvproj_file :str, uvopt_file :str, file_groups :dict, config :dict, preload :TemplatePreload=None, templates=None, preloaded=None) -> bool:
+    # make both files concurrently, then replace both project files.
+    # `templates` default to the project files themselves.
+    from concurrent.futures import ThreadPoolExecutor
+    templates = templates or (uvproj_file, uvopt_file)
+    outputs = [uvproj_file + '.tmp', uvopt_file + '.tmp']
+    preloaded = preloaded or [preload.get(f) if preload else None for f in templates]
+    try:
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            _uvproj = executor.submit(make_project_file, templates[0], file_groups, config, outputs[0], preloaded[0])
+            _uvopt = executor.submit(make_uv_option_file, templates[1], file_groups, config, outputs[1], preloaded[1])
+            made = _uvproj.result() and _uvopt.result()
+        if made:
+            os.replace(outputs[0], uvproj_file)
+            os.replace(outputs[1], uvopt_file)
+    finally:
+        for f in outputs:
+            _remove_quietly(f)
+    return made
+
+def _safe_name(group_name :str) -> str:
+    return re.sub(r'\W+', '_', group_name).strip('_') or 'lib'
+
+def _output_directory(uvproj_file :str, config :dict) -> str:
+    # `OutputDirectory`, or the one in `uvproj_file`, as a relative path
+    output_dir = config['ProjectOptions'].get('OutputDirectory')
+    if output_dir is None:
+        output_dir = _extract_xml(uvproj_file, {'dir': '/Project/Targets/Target/TargetOption/TargetCommonOption/OutputDirectory'})['dir'] or ''
+    return path.normpath(output_dir.replace('\\', '/')) if output_dir else ''
+
+def shard_file_groups(file_groups :'FileGroups', config :dict, project_dir :str, project_name :str) -> tuple:
+    '''
+        split compiled files of `file_groups` into library projects (see
+        `lib_shards` in the config file). returns (file groups of the project,
+        {library project name: (file groups, config)}).
 
-def reverse_config():
-    project_dir = config['ProjectDirectory']
-    if not path.exists(project_dir):
-        logger.error('Project directory not exist: "{}", please check your config file or command line option (option `-D`)'.format(project_dir))
-        sys.exit(-1)
+        the project keeps files that are not compiled and groups in
+        `lib_shard_keep`, and links the libraries in group `lib_group_name`.
+    '''
+    from copy import deepcopy
+    _uvmake = config['uvmake']
+    method = _uvmake.get('lib_shards', 'NONE')
+    keep = set(_uvmake.get('lib_shard_keep') or [])
+    table = file_groups.table
 
-    old_dir = os.getcwd()
-    os.chdir(project_dir)
+    top = FileGroups(table)
+    compiled = OrderedDict() # group name -> [index, ...]
+    for g in file_groups:
+        rest = []
+        for r in file_groups.records(g):
+            if g in keep or not r.type in UvFileType.COMPILED:
+                rest.append(r.index)
+            else:
+                compiled.setdefault(g, []).append(r.index)
+        if rest:
+            top.groups[g] = rest
+
+    shards = OrderedDict() # name -> {group name: [index, ...]}
+    if method == 'BY_GROUP':
+        for g, ix in compiled.items():
+            name = _safe_name(g)
+            _name, n = name, 1
+            while _name in shards:
+                n += 1
+                _name = '{}_{}'.format(name, n)
+            shards[_name] = OrderedDict([(g, ix)])
+    elif method == 'BALANCED':
+        count = max(1, int(_uvmake.get('lib_shard_count', 4)))
+        ix = [(g, i) for g, _ix in compiled.items() for i in sorted(_ix, key=lambda i: table[i].name)]
+        sizes = []
+        for g, i in ix:
+            try:
+                sizes.append(os.stat(table[i].abspath).st_size)
+            except OSError:
+                sizes.append(0)
+        total, done = sum(sizes) or 1, 0
+        for (g, i), size in zip(ix, sizes):
+            name = 'lib{}'.format(min(count - 1, done * count // total) + 1)
+            shards.setdefault(name, OrderedDict()).setdefault(g, []).append(i)
+            done += size
+    else:
+        raise ConfigError('Invalid value for `lib_shards`: {}'.format(method))
+
+    output_dir = _output_directory(path.join(project_dir, project_name + '.uvproj'), config)
+    lib_group = _uvmake.get('lib_group_name', 'Libraries')
+    result = OrderedDict()
+    for name, groups in shards.items():
+        lib_name = '{}_{}'.format(project_name, name)
+        top.groups.setdefault(lib_group, []).append(table.add(path.join(project_dir, output_dir, lib_name + '.LIB')))
+        _config = deepcopy(config)
+        _opts = _config['ProjectOptions']
+        _opts['OutputName'] = lib_name
+        _opts['CreateExecutableOrLib'] = 'lib'
+        _opts['CreateHexFile'] = False
+        result[lib_name] = (FileGroups(table, groups), _config)
+    return top, result
+
+def make_sharded_project(project_dir :str, project_name :str, file_groups :'FileGroups', config :dict, backup=True, fingerprint_file=None, check=False, preload :TemplatePreload=None) -> bool:
+    '''
+        `make_project()` with library projects, see `shard_file_groups()`.
 
-    project_name = config['ProjectName']
-    if (not project_name) or \
-        (not path.exists(project_name + '.uvproj')) or \
-        (not path.exists(project_name + '.uvopt')):
+        library projects are made from the project files as they are before
+        this run, all concurrently with the project, under one `ProjectLock`.
+        a library project is made again when its files, its file groups or
+        options, or the project files change. library projects no longer
+        made are removed by `make_project()`.
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+    file_groups = FileGroups.from_dict(file_groups)
+    file_groups.table.relative_to(project_dir)
+    project_files = [path.join(project_dir, project_name + ext) for ext in ('.uvproj', '.uvopt')]
+    top, libs = shard_file_groups(file_groups, config, project_dir, project_name)
+
+    def _files(name):
+        return [path.join(project_dir, name + ext) for ext in ('.uvproj', '.uvopt')]
+    def _fingerprint_file(name):
+        return '{}.{}'.format(fingerprint_file, name) if fingerprint_file else None
+    def _fingerprint(name):
+        groups, _config = libs[name]
+        return project_fingerprint(groups.sorted_by_name(), _files(name) + project_files, _config)
+    def _up_to_date(name):
+        return bool(fingerprint_file) and _fingerprint(name) == _read_fingerprint(_fingerprint_file(name))
+
+    if check:
+        up_to_date = make_project(project_dir, project_name, top, config, fingerprint_file=fingerprint_file, check=True, libraries=libs)
+        for name in libs:
+            _up = _up_to_date(name)
+            logger.info('Library project "{}" is {}.'.format(name, 'up to date' if _up else 'out of date'))
+            up_to_date = up_to_date and _up
+        return up_to_date
+    if not path.isdir(project_dir):
+        raise ProjectFileError('Project directory not exist: "{}"'.format(project_dir))
+
+    def _make_library(name, templates):
+        groups, _config = libs[name]
+        logger.info('Making library project: ' + name)
+        preloaded = templates
+        if _config['uvmake'].get('write_engine') != 'splice':
+            preloaded = [_parse_xml_doc(f, data) for f, data in zip(project_files, templates)]
+        return _make_project_files(*_files(name), groups.sorted_by_name(), _config, templates=project_files, preloaded=preloaded)
 
-        logger.error('Project files: "{}.uvproj" or "{}.uvopt" not exist'.format(project_name, project_name))
-        logger.info('Trying to find project files (*.uvproj and *.uvopt) in directory "{}"'.format(project_dir))
+    try:
+        with ProjectLock(project_dir):
+            pending = [name for name in libs if not _up_to_date(name)]
+            for name in libs:
+                if not name in pending:
+                    logger.info('Library project "{}" is up to date.'.format(name))
+            top_up_to_date = bool(fingerprint_file) and \
+                project_fingerprint(top.sorted_by_name(), project_files, config) == _read_fingerprint(fingerprint_file)
+            stale = _stale_libraries(project_name, fingerprint_file, libs) # removed by `make_project()`
+            if top_up_to_date and not pending and not stale:
+                logger.info('Project files are up to date.')
+                return True
+            templates = []
+            for f in project_files:
+                if not path.exists(f):
+                    raise ProjectFileError('Project file "{}" not found!'.format(f))
+                with open(f, 'rb') as _f:
+                    templates.append(_f.read())
+            if backup:
+                _backup = ([] if top_up_to_date else project_files) + [f for name in pending + stale for f in _files(name) if path.exists(f)]
+                BackupStore(project_dir, config['uvmake'].get('backup_generations', 10)).backup(_backup)
+            with ThreadPoolExecutor(max_workers=len(pending) + 1) as executor:
+                _top = executor.submit(make_project, project_dir, project_name, top, config,
+                    backup=False, fingerprint_file=fingerprint_file, preload=preload, lock=False, libraries=libs)
+                _libs = [executor.submit(_make_library, name, templates) for name in pending]
+                up_to_date = all([_top.result()] + [_lib.result() for _lib in _libs])
+            if up_to_date and fingerprint_file:
+                # fingerprints of library projects cover the project files,
+                # so they're taken when all is made
+                for name in libs:
+                    _write_fingerprint(_fingerprint_file(name), _fingerprint(name))
+    except UvMakeError:
+        raise
+    except Exception as e:
+        raise ProjectFileError('Error occurred, cancelling... ({})'.format(e)) from e
+    return up_to_date
+
+def _find_project_name(project_dir :str, project_name :str) -> str:
+    if project_name and \
+        path.exists(path.join(project_dir, project_name + '.uvproj')) and \
+        path.exists(path.join(project_dir, project_name + '.uvopt')):
+        return project_name
+
+    logger.error('Project files: "{}.uvproj" or "{}.uvopt" not exist'.format(project_name, project_name))
+    logger.info('Trying to find project files (*.uvproj and *.uvopt) in directory "{}"'.format(project_dir))
+    
+    uvproj = [f for f in os.listdir(project_dir) if f.endswith('.uvproj')]
+    uvopt = [f for f in os.listdir(project_dir) if f.endswith('.uvopt')]
+
+    if not (len(uvproj) == 1 and len(uvopt)==1):
+        raise ProjectFileError('Multiple project files found: ' + '\n  ' + '\n  '.join(uvproj + uvopt))
         
-        uvproj = [f for f in os.listdir('./') if f.endswith('.uvproj')]
-        uvopt = [f for f in os.listdir('./') if f.endswith('.uvopt')]
+    uvproj = uvproj[0].split('.', maxsplit=1)[0]
+    uvopt  = uvopt[0].split('.', maxsplit=1)[0]
+    if not uvproj == uvopt:
+        raise ProjectFileError('Multiple project files found: ' + '\n  ' + '\n  '.join([uvproj, uvopt]))
 
-        if not (len(uvproj) == 1 and len(uvopt)==1):
-            logger.error('Multiple project files found: ' + '\n  ' + '\n  '.join(uvproj + uvopt))
-            logger.info('Exit.')
-            sys.exit(-1)
-            
-        uvproj = uvproj[0].split('.', maxsplit=1)[0]
-        uvopt  = uvopt[0].split('.', maxsplit=1)[0]
-        if not uvproj == uvproj:
-            logger.error('Multiple project files found: ' + '\n  ' + '\n  '.join(uvproj + uvopt))
-            logger.info('Exit.')
-            sys.exit(-1)
+    logger.info('Found project files: "{}.uvproj" and "{}.uvopt"'.format(uvproj, uvopt))
+    return uvproj
+
+def _extract_xml(xml_file :str, fields :dict, lists=(), name :str=None) -> dict:
+    '''
+        read `fields` {name: element path} and `lists` {name: element path}
+        from `xml_file`, in one streaming pass. returns {name: text} for the
+        first element found on each path of `fields`, and {name: [text, ...]}
+        for all elements on each path of `lists`.
+
+        elements are dropped as soon as they are read, and reading stops
+        once all `fields` are found if there are no `lists`. `xml_file` may
+        also be a file object, `name` is then used in messages.
+    '''
+    et = _et()
+    lists = dict(lists)
+    result = {name: None for name in fields}
+    result.update({name: [] for name in lists})
+    _fields = {p: name for name, p in fields.items()}
+    _lists = {p: name for name, p in lists.items()}
+    _missing = len(_fields)
+
+    logger.info('Reading project file: ' + (name or xml_file))
+    stack = []
+    with stats.phase('parse xml'):
+        for event, elem in et.iterparse(xml_file, events=('start', 'end'), remove_comments=True, huge_tree=True):
+            if event == 'start':
+                stack.append(elem.tag)
+                continue
+            p = '/' + '/'.join(stack)
+            stack.pop()
+            name = _fields.get(p)
+            if name and result[name] is None:
+                result[name] = elem.text or ''
+                _missing -= 1
+                if not _missing and not _lists:
+                    break
+            name = _lists.get(p)
+            if name:
+                result[name].append(elem.text or '')
+            # drop what has been read
+            elem.clear(keep_tail=True)
+            parent = elem.getparent()
+            if parent is not None:
+                while elem.getprevious() is not None:
+                    del parent[0]
+    return result
 
-        logger.info('Found project files: "{}.uvproj" and "{}.uvopt"'.format(project_name, project_name))
-        project_name = uvproj
-        config['ProjectName'] = uvproj
+def reverse_config(config :dict, project_dir :str):
+    '''
+        update `config` according to project files in `project_dir`
+    '''
+    if not path.exists(project_dir):
+        raise ProjectFileError('Project directory not exist: "{}", please check your config file or command line option (option `-D`)'.format(project_dir))
 
-    root = _parse_xml_doc(project_name + '.uvproj').getroot()
+    project_name = _find_project_name(project_dir, config['ProjectName'])
+    config['ProjectName'] = project_name
 
-    def __get(xp):
-        return root.xpath(xp)[0].text
+    _base = '/Project/Targets/Target/TargetOption/TargetCommonOption/'
+    _uvproj = _extract_xml(
+        path.join(project_dir, project_name + '.uvproj'),
+        fields={
+            'TargetName': '/Project/Targets/Target/TargetName',
+            'OutputName': _base + 'OutputName',
+            'OutputDirectory': _base + 'OutputDirectory',
+            'CreateHexFile': _base + 'CreateHexFile',
+            'CreateExecutable': _base + 'CreateExecutable',
+            'CreateLib': _base + 'CreateLib',
+            'IncludePath': '/Project/Targets/Target/TargetOption/Target51/C51/VariousControls/IncludePath',
+            },
+        lists={'FilePath': '/Project/Targets/Target/Groups/Group/Files/File/FilePath'}
+        )
+    _missing = [name for name, value in _uvproj.items() if value is None]
+    if _missing:
+        raise ProjectFileError('Missing {} in project file of "{}"'.format(', '.join(_missing), project_name))
 
     # 1
     # config['SourceDirectories'] = [] # when `SourceDirectories` is edited by hand, is't not proper to empty it during reverse configuring 
 
-    # gather files in project
-    _files = [_node.text for _node in root.xpath('/Project/Targets/Target/Groups//File/FilePath')]
-    # convert to absolute path
-    _files = [path.abspath(f) for f in _files]
-    logger.debug('Files in project:' + '\n  ' + '\n  '.join(_files))
+    # gather files in project, as absolute path
+    _files = [path.normpath(path.join(project_dir, _host_path(f))) for f in _uvproj['FilePath']]
+    logger.debug('Files in project:%s', _lines(_files))
     # 2
     config['SourceFiles'] = _files
     # 3
-    config['ProjectOptions']['TargetName'] = __get('/Project/Targets/Target/TargetName')
-
-    _base = '/Project/Targets/Target/TargetOption/TargetCommonOption/'
-    config['ProjectOptions']['OutputName'] = __get(_base +'OutputName')
-    config['ProjectOptions']['OutputDirectory'] = __get(_base +'OutputDirectory')
-    config['ProjectOptions']['CreateHexFile'] = True if __get(_base +'CreateHexFile') else False
+    config['ProjectOptions']['TargetName'] = _uvproj['TargetName']
+    config['ProjectOptions']['OutputName'] = _uvproj['OutputName']
+    config['ProjectOptions']['OutputDirectory'] = _uvproj['OutputDirectory']
+    config['ProjectOptions']['CreateHexFile'] = _uvproj['CreateHexFile'] == '1'
 
-    if (__get(_base +'CreateExecutable') == '1' and \
-        __get(_base +'CreateLib') == '0'):
+    if (_uvproj['CreateExecutable'] == '1' and _uvproj['CreateLib'] == '0'):
         config['ProjectOptions']['CreateExecutableOrLib'] = 'exe'
-    elif (__get(_base +'CreateExecutable') == '0' and \
-        __get(_base +'CreateLib') == '1'):
+    elif (_uvproj['CreateExecutable'] == '0' and _uvproj['CreateLib'] == '1'):
         config['ProjectOptions']['CreateExecutableOrLib'] = 'lib'
     else:
-        logger.warning('Wrong value combinition: CreateExecutable={} and CreateLib={}'.format(__get(_base +'CreateExecutable'), __get(_base +'CreateLib')))
+        logger.warning('Wrong value combinition: CreateExecutable={} and CreateLib={}'.format(_uvproj['CreateExecutable'], _uvproj['CreateLib']))
 
     # 4
-    _inc = __get('/Project/Targets/Target/TargetOption/Target51/C51/VariousControls/IncludePath')
+    _inc = _uvproj['IncludePath']
     config['ProjectOptions']['IncludePaths'] = _inc.strip(';').split(';') if _inc else []
 
     # 5
-    root = _parse_xml_doc(project_name + '.uvopt').getroot()
-    config['UVisionOptions']['ClockFrequency'] = int(__get('/ProjectOpt/Target/TargetOption/CLK51'))
-
-    os.chdir(old_dir)
-    _dump_config(config, args.config_file)
-
-    logger.info('Config file updated.')
+    _uvopt = _extract_xml(
+        path.join(project_dir, project_name + '.uvopt'),
+        fields={'CLK51': '/ProjectOpt/Target/TargetOption/CLK51'}
+        )
+    if _uvopt['CLK51'] is None:
+        raise ProjectFileError('Missing CLK51 in option file of "{}"'.format(project_name))
+    config['UVisionOptions']['ClockFrequency'] = int(_uvopt['CLK51'])
+    return config
 
 class UvFileType():
     _type_map = {
@@ -598,7 +1958,9 @@ class UvFileType():
     HEADER = _type_map['.h']
     C      = _type_map['.c']
     CPP    = _type_map['.cpp']
+    OBJECT = _type_map['.obj']
     LIB    = _type_map['.lib']
+    OTHER  = _type_map['.*']
 
     # convenience lambdas
     is_header  = lambda fn: fn.lower().endswith('.h')
@@ -606,236 +1968,1833 @@ class UvFileType():
     is_cpp     = lambda fn: fn.lower().endswith('.cpp')
     is_library = lambda fn: fn.lower().endswith('.lib')
 
+    # types of files compiled into objects
+    COMPILED = (_type_map['.c'], _type_map['.src'], _type_map['.plm'], _type_map['.cpp'])
+
+    # files picked up from source directories have one of the exact suffixes
+    # of `_type_map` or one of these. the wildcard keys are only for files
+    # listed in `SourceFiles`, they'd catch build.sh, logo.svg or *.swp too.
+    _walked_exts = ('.s', '.a', '.a51', '.asm')
+
+    @classmethod
+    def _compile(cls):
+        # exact suffixes are looked up in a dict. wildcard keys are merged into
+        # one pattern, a capture group per key, kept in the order of `_type_map`.
+        cls._exact_map = {ext: t for ext, t in cls._type_map.items() if not '*' in ext}
+        _wildcards = [ext for ext in cls._type_map if '*' in ext]
+        cls._wildcard_types = [cls._type_map[ext] for ext in _wildcards]
+        cls._wildcard_pattern = re.compile(
+            '|'.join('({})'.format(re.escape(ext).replace(r'\*', '.*')) for ext in _wildcards)
+            )
+        cls._memo = dict() # extension -> file type
+        cls._walked = frozenset(cls._exact_map).union(cls._walked_exts)
+
     @classmethod
     def of(cls, file_name):
-        file_name = file_name.lower()
-        for ext in cls._type_map:
-            if('*' in ext): # use regular expression
-                extpattern = ext.replace('*', '.*').replace('.', '\.') + '$'
-                extpattern = re.compile(extpattern)
-                if extpattern.search(file_name):
-                    return cls._type_map[ext]
-            else:
-                if file_name.endswith(ext):
-                    return cls._type_map[ext]
-        return None
+        _dot = file_name.rfind('.')
+        if _dot < 0:
+            return None
+        ext = file_name[_dot:].lower()
+        try:
+            return cls._memo[ext]
+        except KeyError:
+            pass
+        # no wildcard key precedes an exact key that it also matches,
+        # so checking exact suffixes first keeps the precedence of `_type_map`.
+        file_type = cls._exact_map.get(ext)
+        if file_type is None:
+            m = cls._wildcard_pattern.fullmatch(ext)
+            if m:
+                file_type = cls._wildcard_types[m.lastindex - 1]
+        cls._memo[ext] = file_type
+        return file_type
 
-# `file_grouping_method` implementation base.
-class FileGrouping():
+    @classmethod
+    def classify_many(cls, file_names, listed=False) -> list:
+        '''
+            types of `file_names`. with `listed` (names listed in a directory),
+            files that are not picked up from directories get None.
+        '''
+        _of = cls.of
+        if not listed:
+            return [_of(f) for f in file_names]
+        _walked = cls._walked
+        file_types = []
+        for f in file_names:
+            _dot = f.rfind('.')
+            file_types.append(_of(f) if _dot >= 0 and f[_dot:].lower() in _walked else None)
+        return file_types
+
+UvFileType._compile()
+
+# paths inside project files are Windows paths, read by uVision, whatever
+# the host running `uvmake` is. they are worked out with `ntpath`, never
+# with `os.path` of the host.
+
+def _win_path(p :str) -> str:
+    # host path -> Windows path
+    return p.replace(os.sep, '\\') if os.sep != '\\' else p
+
+def _host_path(p :str) -> str:
+    # Windows path (e.g. `FilePath` in a project file) -> host path
+    return p.replace('\\', os.sep) if os.sep != '\\' else p
+
+@lru_cache(maxsize=4096)
+def _win_relpath(dirpath :str, start :str) -> str:
+    '''
+        `dirpath` relative to `start`, as a Windows path.
+    '''
+    return _win_path(path.relpath(dirpath, start=start))
+
+class FileRecord():
+    '''
+        a gathered file. everything about its path is worked out once, when
+        it's added to a `FileTable`, except `relpath` (see `FileTable.relative_to()`).
+    '''
+    __slots__ = ('index', 'abspath', 'dirpath', 'name', 'ext', 'type', 'relpath')
+
+    def __init__(self, index :int, abspath :str):
+        _intern = sys.intern
+        dirpath, name = path.split(abspath)
+        _dot = name.rfind('.')
+        self.index = index
+        self.abspath = abspath
+        self.dirpath = _intern(dirpath)
+        self.name = _intern(name)
+        self.ext = _intern(name[_dot:].lower()) if _dot >= 0 else ''
+        self.type = UvFileType.of(name)
+        self.relpath = None
+
+    def __repr__(self):
+        return 'FileRecord({}, {!r})'.format(self.index, self.abspath)
+
+class FileTable():
+    '''
+        records of gathered files. stages of the pipeline refer to files by
+        their index in `records`.
+    '''
     def __init__(self):
-        self._file_groups = OrderedDict()
-        self._other_group_name = config['uvmake']['other_files_group_name']
-        self._recent_group = ''
+        self.records = []
+        self._index = dict() # normalized absolute path -> index
+        self._relative_to = None
+        self._dir_relpaths = dict() # directory -> path relative to `_relative_to`
 
-    def has_gathered(self, filepath :str):
+    def _key(self, abspath :str):
+        return path.normcase(abspath)
 
-        __dup_warning = lambda filepath: logger.info('Ignored duplicate file: "{}"'.format(filepath))
+    def add(self, filepath :str) -> int:
+        '''
+            returns the index of `filepath`, adding it if it's not in the table.
+        '''
+        abspath = path.abspath(filepath)
+        key = self._key(abspath)
+        index = self._index.get(key)
+        if index is None:
+            index = len(self.records)
+            record = FileRecord(index, abspath)
+            if self._relative_to:
+                record.relpath = self._relpath(record)
+            self.records.append(record)
+            self._index[key] = index
+            stats.count('files classified')
+        return index
+
+    def find(self, filepath :str):
+        # index of `filepath`, None if it's not in the table
+        return self._index.get(self._key(path.abspath(filepath)))
+
+    def __getitem__(self, index :int) -> FileRecord:
+        return self.records[index]
+
+    def __len__(self):
+        return len(self.records)
+
+    def _relpath(self, record :FileRecord) -> str:
+        d = self._dir_relpaths.get(record.dirpath)
+        if d is None:
+            d = self._dir_relpaths[record.dirpath] = _win_relpath(record.dirpath, self._relative_to)
+        return ntpath.join(d, record.name) if d != '.' else record.name
+
+    def relative_to(self, project_dir :str):
+        '''
+            set `relpath` of every record, a Windows path relative to
+            `project_dir`. it's worked out once per directory.
+        '''
+        if self._relative_to == project_dir:
+            return
+        self._relative_to = project_dir
+        self._dir_relpaths = dict()
+        for r in self.records:
+            r.relpath = self._relpath(r)
 
-        if len(self._file_groups) <= 3:
-            for g in self._file_groups:
-                if filepath in self._file_groups[g]:
-                    __dup_warning(filepath)
-                    return True
-            return False
-        else:
-            if filepath in self._file_groups[self._recent_group]:
-                return True
+class FileGroups():
+    '''
+        groups of files as {group name: [index in `table`, ...]}, made by
+        `FileGrouping.get()`.
+
+        it also reads like {group name: [absolute path, ...]}, the form
+        accepted by functions taking `file_groups`.
+    '''
+    def __init__(self, table :FileTable, groups :OrderedDict=None):
+        self.table = table
+        self.groups = groups if groups is not None else OrderedDict()
 
-            keys = [*self._file_groups.keys()]
-            m = keys.index(self._recent_group)
+    @classmethod
+    def from_dict(cls, file_groups :dict):
+        '''
+            make `FileGroups` from {group name: [file path, ...]}. until
+            `table.relative_to()` is called, `relpath` of a record is the path
+            as given.
+        '''
+        if isinstance(file_groups, FileGroups):
+            return file_groups
+        table = FileTable()
+        groups = OrderedDict()
+        for g, files in file_groups.items():
+            groups[g] = []
+            for f in files:
+                index = table.add(f)
+                table[index].relpath = table[index].relpath or f
+                groups[g].append(index)
+        return cls(table, groups)
+
+    def __iter__(self):
+        return iter(self.groups)
+
+    def __len__(self):
+        return len(self.groups)
+
+    def __contains__(self, group_name):
+        return group_name in self.groups
+
+    def __getitem__(self, group_name) -> list:
+        records = self.table.records
+        return [records[i].abspath for i in self.groups[group_name]]
+
+    def __delitem__(self, group_name):
+        del self.groups[group_name]
+
+    def __eq__(self, other):
+        if isinstance(other, FileGroups):
+            if self.table is other.table:
+                return self.groups == other.groups
+            return self.as_dict() == other.as_dict()
+        if isinstance(other, dict):
+            return self.as_dict() == other
+        return NotImplemented
+
+    def keys(self):
+        return self.groups.keys()
+
+    def items(self):
+        return ((g, self[g]) for g in self.groups)
+
+    def records(self, group_name) -> list:
+        records = self.table.records
+        return [records[i] for i in self.groups[group_name]]
+
+    def as_dict(self) -> OrderedDict:
+        return OrderedDict(self.items())
+
+    def sorted_by_name(self):
+        # a copy of the groups, files sorted by file name in each group
+        records = self.table.records
+        return FileGroups(self.table, OrderedDict(
+            (g, sorted(ix, key=lambda i: records[i].name)) for g, ix in self.groups.items()))
 
-            for i in range(m):
-                if filepath in self._file_groups[keys[i]]:
-                    __dup_warning(filepath)
-                    return True
-            
-            for i in range(m, len(keys)):
-                if filepath in self._file_groups[keys[i]]:
-                    __dup_warning(filepath)
-                    return True
-            return False
+# `file_grouping_method` implementation base.
+class FileGrouping():
+    def __init__(self, config :dict):
+        self.table = FileTable()
+        # False when files made by the grouping are found out of date,
+        # without being written (see `FileGroupingUnityByFolder`)
+        self.up_to_date = True
+        self._file_groups = OrderedDict() # group name -> [index in `table`, ...]
+        self._other_group_name = config['uvmake']['other_files_group_name']
+        # group name of every gathered file by index, so that duplicate
+        # checks don't scan the group lists.
+        self._gathered = dict()
+
+    def has_gathered(self, index :int):
+        if index in self._gathered:
+            logger.info('Ignored duplicate file: "{}"'.format(self.table[index].abspath))
+            stats.count('duplicates dropped')
+            return True
+        return False
 
     def gather(self, filepaths :list):
+        add, records = self.table.add, self.table.records
         for filepath in filepaths:
-            filepath = PurePath(path.normpath(path.abspath(filepath)))
-            if self.has_gathered(filepath):
+            index = add(filepath)
+            if self.has_gathered(index):
                 continue
-            self.gather_it(filepath)
+            self.gather_it(records[index])
 
     # method function that actually handles files,
     # implemented in subclasses.
     # grouping method differs in how `gather_it()`
     # handles the files passed in.
-    def gather_it(self):
+    def gather_it(self, record :FileRecord):
         logger.error('Calling un-implemented method!')
         pass
 
-    def to_group(self, group_name, filepath):
+    def to_group(self, group_name, record :FileRecord):
         if not self._file_groups.get(group_name):
             self._file_groups[group_name] = []
-        self._file_groups[group_name].append(filepath)
-        self._recent_group = group_name
+        self._file_groups[group_name].append(record.index)
+        self._gathered[record.index] = group_name
     
-    def to_other_group(self, filepath :list):
-        if not self._file_groups.get(self._other_group_name):
-            self._file_groups[self._other_group_name] = []
-        self._file_groups[self._other_group_name].append(filepath)
-        self._recent_group = self._other_group_name
+    def to_other_group(self, record :FileRecord):
+        self.to_group(self._other_group_name, record)
 
-    def get(self):
+    def remove(self, filepath):
+        index = self.table.find(filepath)
+        group_name = self._gathered.pop(index, None)
+        if group_name is None:
+            return False
+        self._file_groups[group_name].remove(index)
+        if not self._file_groups[group_name]:
+            del self._file_groups[group_name]
+        return True
+
+    def get(self, prepare=None) -> FileGroups:
+        '''
+            `prepare(file_groups)` is called on the gathered files, before
+            files made by the grouping are added (see `FileGroupingUnityByFolder`).
+        '''
         if self._file_groups.get(self._other_group_name):
             # how suitable the method is, for this use case!
             self._file_groups.move_to_end(self._other_group_name, last=True)
-        _file_groups = self._file_groups
-        # convert PurePath object to str
-        for g in _file_groups:
-            _file_groups[g] = [str(f) for f in _file_groups[g]]
-        return _file_groups
+        # copy the index lists, leaving gathered files as they are
+        file_groups = FileGroups(self.table, OrderedDict((g, list(ix)) for g, ix in self._file_groups.items()))
+        if prepare:
+            prepare(file_groups)
+        return file_groups
 
 # implements file grouping method 'NONE'.
 class FileGroupingNone(FileGrouping):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, config :dict):
+        super().__init__(config)
         self.h_group_name = config['uvmake']['header_group_name']
         self.c_group_name = config['uvmake']['c_group_name']
 
-    def gather_it(self, filepath :str):
-        if UvFileType.is_header(str(filepath)):
-            self.to_group(self.h_group_name, filepath)
-        elif UvFileType.is_c(str(filepath)):
-            self.to_group(self.c_group_name, filepath)
+    def gather_it(self, record :FileRecord):
+        if record.ext == '.h':
+            self.to_group(self.h_group_name, record)
+        elif record.ext == '.c':
+            self.to_group(self.c_group_name, record)
         else:
-            self.to_other_group(filepath)
+            self.to_other_group(record)
             
 # implements file grouping method 'C_BY_FOLDER'.
 class FileGroupingCByFolder(FileGrouping):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, config :dict):
+        super().__init__(config)
         self.h_group_name = config['uvmake']['header_group_name']
 
-    def gather_it(self, filepath :str):
-        if UvFileType.is_header(str(filepath)):
-            self.to_group(self.h_group_name, filepath)
-        elif UvFileType.is_c(str(filepath)):
-            folder_name = path.split(path.dirname(filepath))[1]
-            self.to_group(folder_name, filepath)
+    def gather_it(self, record :FileRecord):
+        if record.ext == '.h':
+            self.to_group(self.h_group_name, record)
+        elif record.ext == '.c':
+            folder_name = path.basename(record.dirpath)
+            self.to_group(folder_name, record)
         else:
-            self.to_other_group(filepath)
+            self.to_other_group(record)
 
 # implements file grouping method 'ALL_BY_FOLDER'.
 class FileGroupingAllByFolder(FileGrouping):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, config :dict):
+        super().__init__(config)
 
-    def gather_it(self, filepath :str):
-        if UvFileType.is_header(str(filepath)) or UvFileType.is_c(str(filepath)):
-            folder_name = path.split(path.dirname(filepath))[1]
-            self.to_group(folder_name, filepath)
+    def gather_it(self, record :FileRecord):
+        if record.ext == '.h' or record.ext == '.c':
+            folder_name = path.basename(record.dirpath)
+            self.to_group(folder_name, record)
         else:
-            self.to_other_group(filepath)
+            self.to_other_group(record)
+
+
+# implements file grouping method 'UNITY_BY_FOLDER'.
+class FileGroupingUnityByFolder(FileGroupingAllByFolder):
+    _generated = '/* generated by uvmake.py, do not edit. */'
+
+    def __init__(self, config :dict, unity_dir :str, readonly=False):
+        super().__init__(config)
+        self.unity_dir = path.abspath(unity_dir)
+        self.max_bytes = int(config['uvmake'].get('unity_max_bytes', 65536))
+        self.readonly = readonly
+        self._unity_dir_key = path.normcase(self.unity_dir)
+
+    def gather_it(self, record :FileRecord):
+        if path.normcase(record.dirpath) == self._unity_dir_key:
+            return # made by `get()`
+        super().gather_it(record)
+
+    def _units(self, records :list) -> list:
+        # split C files into units of up to `max_bytes`
+        units, size = [], 0
+        for r in sorted(records, key=lambda r: r.name):
+            try:
+                _size = os.stat(r.abspath).st_size
+            except OSError:
+                _size = 0
+            if not units or (size + _size > self.max_bytes and units[-1]):
+                units.append([])
+                size = 0
+            units[-1].append(r)
+            size += _size
+        return units
+
+    def _write_unit(self, filepath :str, records :list) -> bool:
+        # returns True if `filepath` is up to date
+        lines = [self._generated]
+        for r in records:
+            lines.append('#include "{}"'.format(path.relpath(r.abspath, self.unity_dir).replace(os.sep, '/')))
+        content = '\n'.join(lines) + '\n'
+        try:
+            with open(filepath, encoding='UTF-8', newline='') as f:
+                if f.read() == content:
+                    return True
+        except OSError:
+            pass
+        if self.readonly:
+            logger.info('Unity file is out of date: ' + filepath)
+            return False
+        logger.info('Writing unity file: ' + filepath)
+        os.makedirs(self.unity_dir, exist_ok=True)
+        with open(filepath + '.tmp', 'w', encoding='UTF-8', newline='') as f:
+            f.write(content)
+        os.replace(filepath + '.tmp', filepath)
+        return True
 
+    def _remove_stale(self, kept :set):
+        # remove unity files made before and not needed any more, and
+        # `unity_dir` if nothing is left in it
+        try:
+            names = os.listdir(self.unity_dir)
+        except OSError:
+            return
+        removed = False
+        for name in names:
+            filepath = path.join(self.unity_dir, name)
+            if name in kept or not re.fullmatch(r'.+_unity\d+\.c', name):
+                continue
+            try:
+                with open(filepath, encoding='UTF-8') as f:
+                    if f.readline().rstrip('\n') != self._generated:
+                        continue
+            except (OSError, UnicodeDecodeError):
+                continue
+            if self.readonly:
+                logger.info('Unity file is out of date: ' + filepath)
+                self.up_to_date = False
+            else:
+                logger.info('Removing unity file: ' + filepath)
+                _remove_quietly(filepath)
+                removed = True
+        if removed and not kept:
+            try:
+                os.rmdir(self.unity_dir)
+            except OSError:
+                pass # not empty
+
+    def get(self, prepare=None) -> FileGroups:
+        '''
+            unity files are added to the groups (and written), and the C files
+            they include become non-built (type of header files).
+        '''
+        file_groups = super().get(prepare)
+        names = set()
+        for g in file_groups:
+            records = [r for r in file_groups.records(g) if r.ext == '.c']
+            if not records:
+                continue
+            name = _safe_name(g)
+            _name, n = name, 1
+            while _name in names:
+                n += 1
+                _name = '{}_{}'.format(name, n)
+            names.add(_name)
+            for n, unit in enumerate(self._units(records), 1):
+                filepath = path.join(self.unity_dir, '{}_unity{}.c'.format(_name, n))
+                if not self._write_unit(filepath, unit):
+                    self.up_to_date = False
+                file_groups.groups[g].insert(0, self.table.add(filepath))
+                for r in unit:
+                    r.type = UvFileType.HEADER
+        self._remove_stale({path.basename(self.table[i].abspath) for g in file_groups for i in file_groups.groups[g] \
+            if path.normcase(self.table[i].dirpath) == self._unity_dir_key})
+        return file_groups
+
+def _list_dir(dirpath :str):
+    '''
+        returns (filenames, file_types, dirnames) of `dirpath`. symbolic links
+        to directories are not followed, like `os.walk()`.
+    '''
+    filenames, dirnames = [], []
+    try:
+        with os.scandir(dirpath) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir():
+                        if not entry.is_symlink():
+                            dirnames.append(entry.name)
+                    else:
+                        filenames.append(entry.name)
+                except OSError:
+                    filenames.append(entry.name)
+    except OSError as e:
+        logger.warning('Cannot list directory "{}": {}'.format(dirpath, e))
+    filenames.sort()
+    dirnames.sort()
+    return filenames, UvFileType.classify_many(filenames, listed=True), dirnames
+
+class FileCache():
+    '''
+        on-disk cache of what is read from files, as JSON.
 
-def gather_source_files(dirs :list, more_files :list, grouping :FileGrouping) -> dict:
-    exclude_keywords = config['uvmake']['exclude_keywords']
-    max_dir_tree_level = config['uvmake']['max_dir_tree_level']
+        entries are keyed by absolute file path and are valid as long as
+        the mtime and size of the file don't change. without `filepath`,
+        the cache is kept in memory only.
+    '''
+    version = 1
+    name = 'file cache'
+    section = 'files' # key of the entries in the cache file
+    stamp = 'size'    # field of `os.stat()` checked along with the mtime
+
+    def __init__(self, filepath :str, rescan=False, readonly=False):
+        self.filepath = filepath
+        self.readonly = readonly
+        self.hits = 0
+        self.misses = 0
+        self._entries = dict()
+        self._visited = dict()
+        self._lock = threading.Lock()
+        if not rescan:
+            self._load()
+
+    def _load(self):
+        import json
+        if not self.filepath or not path.exists(self.filepath):
+            return
+        try:
+            with open(self.filepath, encoding='UTF-8') as f:
+                _cache = json.load(f)
+            if _cache.get('version') == self.version:
+                self._entries = _cache[self.section]
+        except:
+            logger.warning('Ignored broken {}: "{}"'.format(self.name, self.filepath))
+            logger.debug(traceback.format_exc())
+
+    def _entry(self, filepath :str, read) -> dict:
+        '''
+            returns the entry of `filepath`, with the fields made by `read(filepath)`
+            (as a dict) if the entry is not valid.
+        '''
+        import time
+        key = path.abspath(filepath)
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            return read(filepath)
+        stamp = getattr(st, 'st_' + self.stamp)
+        entry = self._visited.get(key) or self._entries.get(key)
+        hit = entry is not None and entry['mtime'] == st.st_mtime_ns and entry[self.stamp] == stamp
+        if not hit:
+            entry = {
+                # a file changed within the mtime resolution of some file systems
+                # may change again with the same mtime, don't trust it next time.
+                'mtime': st.st_mtime_ns if time.time() - st.st_mtime > 2 else -1,
+                self.stamp: stamp,
+                }
+            entry.update(read(filepath))
+        with self._lock:
+            self._visited[key] = entry
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return entry
 
-    def _dir_tree_level(path_str :str) -> int:
-        return len(re.split(r'\\+|/+', path_str))
+    def lookup(self, filepath :str, field :str, read):
+        '''
+            returns `field` of the entry of `filepath`, made with `read(filepath)`
+            if the entry is not valid.
+        '''
+        return self._entry(filepath, lambda f: {field: read(f)})[field]
 
-    def _filter_kws(file_list :list):
-        # filter files by keywords.
-        return [f for kw in exclude_keywords for f in file_list if not kw in f]
+    def merge(self, other :'FileCache'):
+        '''
+            look up entries loaded by `other` too.
+        '''
+        self._entries.update(other._entries)
+
+    def take(self, other :'FileCache', filepaths :list):
+        '''
+            take the entries of `filepaths` visited by `other`, as if they
+            were visited by this cache.
+        '''
+        for f in filepaths:
+            key = path.abspath(f)
+            entry = other._visited.get(key)
+            if entry is None:
+                continue
+            if entry == self._entries.get(key):
+                self.hits += 1
+            else:
+                self.misses += 1
+            self._visited[key] = entry
+
+    def save(self):
+        import json
+        if self.readonly or not self.filepath:
+            return
+        if not self.misses and self._visited.keys() == self._entries.keys():
+            return
+        try:
+            with open(self.filepath, 'w', encoding='UTF-8') as f:
+                json.dump({'version': self.version, self.section: self._visited}, f)
+        except OSError as e:
+            logger.warning('Cannot write {} "{}": {}'.format(self.name, self.filepath, e))
+
+class ScanCache(FileCache):
+    '''
+        on-disk cache of directory listings made by `_list_dir()`.
+
+        entries are keyed by absolute directory path and are valid as long as
+        the mtime and inode of the directory don't change.
+    '''
+    version = 2 # types of files not picked up from directories are None
+    name = 'scan cache'
+    section = 'dirs'
+    stamp = 'ino'
+
+    def list_dir(self, dirpath :str):
+        entry = self._entry(dirpath, lambda d: dict(zip(('files', 'types', 'dirs'), _list_dir(d))))
+        return entry['files'], entry['types'], entry['dirs']
+
+def _gitignore_regex(pattern :str):
+    '''
+        translate a line of `.gitignore` into (regex, negated, dir_only),
+        None for blank lines and comments. the regex matches paths relative
+        to the directory of the `.gitignore` file, with '/' as separator.
+    '''
+    pattern = pattern.rstrip('\n').rstrip('\r')
+    if pattern.endswith(' ') and not pattern.endswith('\\ '):
+        pattern = pattern.rstrip(' ')
+    if not pattern or pattern.startswith('#'):
+        return None
+    negated = pattern.startswith('!')
+    if negated:
+        pattern = pattern[1:]
+    elif pattern.startswith('\\'):
+        pattern = pattern[1:]
+    dir_only = pattern.endswith('/')
+    pattern = pattern.rstrip('/')
+    if not pattern:
+        return None
+    # a pattern with a slash (but at the end) is relative to the `.gitignore`,
+    # others match at any level below it.
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+
+    regex, i = [], 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            regex.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('/**', i) and i + 3 == len(pattern):
+            regex.append('/.*')
+            i += 3
+        elif pattern.startswith('**', i):
+            regex.append('.*')
+            i += 2
+        elif c == '*':
+            regex.append('[^/]*')
+            i += 1
+        elif c == '?':
+            regex.append('[^/]')
+            i += 1
+        elif c == '[':
+            j = pattern.find(']', i + 2)
+            if j < 0:
+                regex.append(re.escape(c))
+                i += 1
+            else:
+                _class = pattern[i + 1:j]
+                if _class.startswith('!'):
+                    _class = '^' + _class[1:]
+                regex.append('[' + _class.replace('\\', '\\\\') + ']')
+                i = j + 1
+        elif c == '\\' and i + 1 < len(pattern):
+            regex.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            regex.append(re.escape(c))
+            i += 1
+    regex = ''.join(regex)
+    if not anchored:
+        regex = '(?:.*/)?' + regex
+    return re.compile(regex + r'\Z'), negated, dir_only
+
+class ExcludeRules():
+    '''
+        excludes files and directories while walking `SourceDirectories`,
+        an excluded directory is never listed.
+
+        `keywords` are matched anywhere in the full path. `patterns` are glob
+        patterns, matched against the name, or against the path relative to
+        the source directory when they contain a '/'. `regexes` are searched
+        in the path relative to the source directory. paths are matched with
+        '/' as separator, except for `keywords`. with `gitignore`,
+        `.gitignore` files found in source directories are applied as git does.
+
+        all rules of a kind are compiled into one regular expression.
+    '''
+    def __init__(self, keywords=(), patterns=(), regexes=(), gitignore=False):
+        from fnmatch import translate
+        keywords = [kw for kw in (keywords or []) if kw]
+        patterns = [p for p in (patterns or []) if p]
+        regexes = [r for r in (regexes or []) if r]
+        self.key = (tuple(keywords), tuple(patterns), tuple(regexes), bool(gitignore))
+
+        def _compile(parts):
+            return re.compile('|'.join('(?:{})'.format(p) for p in parts)) if parts else None
+        self._keywords = _compile([re.escape(kw) for kw in keywords])
+        self._names = _compile([translate(p) for p in patterns if not '/' in p.rstrip('/')])
+        self._relpaths = _compile([translate(p.strip('/')) for p in patterns if '/' in p.rstrip('/')])
+        self._regexes = _compile(regexes)
+        self.gitignore = bool(gitignore)
+
+    @classmethod
+    def from_config(cls, config :dict):
+        _uvmake = config['uvmake']
+        return cls(
+            keywords=_uvmake.get('exclude_keywords'),
+            patterns=_uvmake.get('exclude_patterns'),
+            regexes=_uvmake.get('exclude_regexes'),
+            gitignore=_uvmake.get('use_gitignore', False)
+            )
+
+    def context(self, root :str) -> tuple:
+        '''
+            returns the context of source directory `root`, for `apply()`.
+        '''
+        return (root, ())
+
+    def _excluded(self, filepath :str, relpath :str, name :str, is_dir :bool, gitignores) -> bool:
+        if self._keywords and self._keywords.search(filepath):
+            return True
+        if self._names and self._names.match(name):
+            return True
+        if self._relpaths and self._relpaths.match(relpath):
+            return True
+        if self._regexes and self._regexes.search(relpath):
+            return True
+        excluded = False
+        for base, rules in gitignores:
+            _relpath = relpath[len(base):].lstrip('/') if base else relpath
+            for regex, negated, dir_only in rules:
+                if (is_dir or not dir_only) and regex.match(_relpath):
+                    excluded = not negated
+        return excluded
+
+    def _read_gitignore(self, dirpath :str) -> list:
+        rules = []
+        try:
+            with open(path.join(dirpath, '.gitignore'), encoding='UTF-8', errors='replace') as f:
+                for line in f:
+                    rule = _gitignore_regex(line)
+                    if rule:
+                        rules.append(rule)
+        except OSError as e:
+            logger.warning('Cannot read "{}": {}'.format(path.join(dirpath, '.gitignore'), e))
+        return rules
+
+    def apply(self, dirpath :str, filenames :list, file_types :list, dirnames :list, context :tuple):
+        '''
+            drop excluded entries of a directory listing made by `_list_dir()`.
+            returns (filenames, file_types, dirnames, context of subdirectories).
+        '''
+        root, gitignores = context
+        if self.gitignore and '.gitignore' in filenames:
+            _base = path.relpath(dirpath, root).replace(os.sep, '/')
+            gitignores = gitignores + ((_base if _base != '.' else '', self._read_gitignore(dirpath)),)
+        if not (self._keywords or self._names or self._relpaths or self._regexes or gitignores):
+            return filenames, file_types, dirnames, (root, gitignores)
+
+        _prefix = path.relpath(dirpath, root).replace(os.sep, '/') + '/'
+        if _prefix == './':
+            _prefix = ''
+        def _keep(name, is_dir):
+            return not self._excluded(path.join(dirpath, name), _prefix + name, name, is_dir, gitignores)
+
+        _files = [(f, t) for f, t in zip(filenames, file_types) if _keep(f, False)]
+        filenames, file_types = [f for f, _ in _files], [t for _, t in _files]
+        dirnames = [d for d in dirnames if _keep(d, True)]
+        return filenames, file_types, dirnames, (root, gitignores)
+
+def _find_git_dir(dirpath :str) -> tuple:
+    '''
+        returns (work tree, git directory) of the repository `dirpath` is in,
+        or (None, None).
+    '''
+    d = path.abspath(dirpath)
+    while True:
+        dotgit = path.join(d, '.git')
+        if path.isdir(dotgit):
+            return d, dotgit
+        if path.isfile(dotgit):
+            # work trees and submodules: "gitdir: <path>"
+            try:
+                with open(dotgit, encoding='UTF-8') as f:
+                    line = f.readline()
+            except OSError:
+                line = ''
+            if line.startswith('gitdir:'):
+                return d, path.normpath(path.join(d, line[len('gitdir:'):].strip()))
+        parent = path.dirname(d)
+        if parent == d:
+            return None, None
+        d = parent
+
+def read_git_index(index_file :str) -> list:
+    '''
+        returns paths of files in git index `index_file` (versions 2 to 4),
+        relative to the work tree with '/' as separator, in index order.
+        submodules and skip-worktree entries (sparse checkout) are left out.
+        raises ValueError if it's not a git index.
+    '''
+    import struct
+    with open(index_file, 'rb') as f:
+        data = f.read()
+    signature, version, count = struct.unpack_from('>4sLL', data)
+    if signature != b'DIRC' or not 2 <= version <= 4:
+        raise ValueError('unsupported git index "{}"'.format(index_file))
+
+    paths = []
+    pos, name = 12, b''
+    _mode_flags = struct.Struct('>24xL32xH').unpack_from
+    for _ in range(count):
+        mode, flags = _mode_flags(data, pos)
+        p = pos + 62
+        skip_worktree = False
+        if version >= 3 and flags & 0x4000:
+            extended_flags, = struct.unpack_from('>H', data, p)
+            skip_worktree = bool(extended_flags & 0x4000)
+            p += 2
+        end = data.index(b'\0', p)
+        if version == 4:
+            # the path is prefix-compressed against the previous one
+            c = data[p]
+            strip = c & 0x7f
+            while c & 0x80:
+                p += 1
+                c = data[p]
+                strip = ((strip + 1) << 7) | (c & 0x7f)
+            p += 1
+            end = data.index(b'\0', p)
+            _name = name[:len(name) - strip] + data[p:end]
+            pos = end + 1
+        else:
+            _name = data[p:end]
+            pos += (end - pos + 8) & ~7 # padded with 1 to 8 NULs
+        # unmerged paths have an entry per stage, in a row
+        if _name != name and (mode & 0o170000) != 0o160000 and not skip_worktree:
+            paths.append(os.fsdecode(_name))
+        name = _name
+    return paths
+
+class GitIndexSource():
+    '''
+        lists `SourceDirectories` from the index of the git repository they
+        are in (`source_provider: GIT_INDEX`), like `walk_source_dirs()` but
+        without listing any directory. directories not in a repository are
+        walked.
+
+        with `untracked`, listings of directories on disk are merged in.
+        otherwise, tracked files of the types walked are left out if they
+        no longer exist on disk.
+    '''
+    def __init__(self, untracked=False, max_workers=None, cache :ScanCache=None):
+        self.untracked = untracked
+        self.max_workers = max_workers
+        self.cache = cache
+        self._trees = dict() # git directory -> tree, see `_tree()`
+
+    def _tree(self, gitdir :str) -> dict:
+        # {directory relative to the work tree ('' for itself): (filenames, dirnames)}
+        tree = self._trees.get(gitdir)
+        if tree is not None:
+            return tree
+        with stats.phase('read git index'):
+            paths = read_git_index(path.join(gitdir, 'index'))
+        stats.count('git index entries', len(paths))
+        tree = {'': ([], [])}
+        for p in paths:
+            d, _, name = p.rpartition('/')
+            entry = tree.get(d)
+            if entry is None:
+                # add `d` and directories above it not added yet
+                missing, _d = [], d
+                while not _d in tree:
+                    missing.append(_d)
+                    _d = _d.rpartition('/')[0]
+                for _d in reversed(missing):
+                    parent, _, sub = _d.rpartition('/')
+                    tree[parent][1].append(sub)
+                    tree[_d] = ([], [])
+                entry = tree[d]
+            entry[0].append(name)
+        for filenames, dirnames in tree.values():
+            filenames.sort()
+            dirnames.sort()
+        self._trees[gitdir] = tree
+        return tree
+
+    def _listing(self, tree :dict, worktree :str, dirpath :str) -> tuple:
+        rel = path.relpath(dirpath, worktree).replace(os.sep, '/')
+        filenames, dirnames = tree.get('' if rel == '.' else rel, ((), ()))
+        if self.untracked:
+            # files on disk include the tracked ones, except deleted ones
+            filenames, file_types, _dirnames = self.cache.list_dir(dirpath) if self.cache else _list_dir(dirpath)
+            dirnames = sorted(set(dirnames).union(_dirnames) - {'.git'})
+            return list(filenames), list(file_types), list(dirnames)
+        file_types = UvFileType.classify_many(filenames, listed=True)
+        # deleted but not staged, still in the index
+        kept = [i for i, t in enumerate(file_types) if t is None or path.isfile(path.join(dirpath, filenames[i]))]
+        if len(kept) < len(filenames):
+            stats.count('deleted files skipped', len(filenames) - len(kept))
+            filenames, file_types = [filenames[i] for i in kept], [file_types[i] for i in kept]
+        return list(filenames), file_types, list(dirnames)
+
+    def walk(self, dirs :list, max_dir_tree_level :int, rules :ExcludeRules=None):
+        '''
+            generates (dir, dirpath, filenames, file_types) like `walk_source_dirs()`.
+        '''
+        import struct
+        rules = rules or ExcludeRules()
+        for d in dirs:
+            worktree, gitdir = _find_git_dir(d)
+            tree = None
+            if gitdir:
+                try:
+                    tree = self._tree(gitdir)
+                except (OSError, ValueError, IndexError, struct.error) as e:
+                    logger.warning('Cannot read git index of "{}": {}'.format(worktree, e))
+            if tree is None:
+                logger.info('Not in a git repository, walking: ' + d)
+                yield from walk_source_dirs([d], max_dir_tree_level, self.max_workers, self.cache, rules)
+                continue
+            stack = [(d, 0, rules.context(d))]
+            while stack:
+                dirpath, level, context = stack.pop()
+                filenames, file_types, dirnames, subcontext = rules.apply(dirpath, *self._listing(tree, worktree, dirpath), context)
+                if level < max_dir_tree_level:
+                    stack.extend((path.join(dirpath, sub), level + 1, subcontext) for sub in reversed(dirnames))
+                yield d, dirpath, filenames, file_types
+
+def walk_source_dirs(dirs :list, max_dir_tree_level :int, max_workers=None, cache :ScanCache=None, rules :ExcludeRules=None):
+    '''
+        generates (dir, dirpath, filenames, file_types) for each of `dirs` and
+        directories below it, at most `max_dir_tree_level` levels, top-down
+        like `os.walk()`. entries excluded by `rules` are dropped, excluded
+        directories are not listed.
+
+        directories are listed on a thread pool (through `cache` if given)
+        ahead of the caller, the ones to be generated next first. at most
+        `4 * max_workers` listings are in flight or waiting for the caller,
+        more are started as the caller goes on.
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+    list_dir = cache.list_dir if cache else _list_dir
+    rules = rules or ExcludeRules()
+    window = 4 * (max_workers or min(32, (os.cpu_count() or 1) + 4))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # [dir, dirpath, level, context of `rules`, listing or None], the next one on top
+        stack = [[d, d, 0, rules.context(d), None] for d in reversed(dirs)]
+        held = 0 # listings started and not generated yet
+
+        def _refill():
+            nonlocal held
+            for entry in reversed(stack):
+                if held >= window:
+                    break
+                if entry[4] is None:
+                    entry[4] = executor.submit(list_dir, entry[1])
+                    held += 1
+
+        _refill()
+        while stack:
+            root, d, level, context, listing = stack.pop()
+            if listing is None:
+                listing = executor.submit(list_dir, d)
+            else:
+                held -= 1
+            filenames, file_types, dirnames, subcontext = rules.apply(d, *listing.result(), context)
+            if level < max_dir_tree_level:
+                stack.extend([root, path.join(d, sub), level + 1, subcontext, None] for sub in reversed(dirnames))
+            _refill()
+            yield root, d, filenames, file_types
+
+def scan_source_dirs(dirs :list, max_dir_tree_level :int, max_workers=None, cache :ScanCache=None, rules :ExcludeRules=None) -> OrderedDict:
+    '''
+        list files in `dirs` with `walk_source_dirs()`. returns
+        {dir: [(dirpath, filenames, file_types), ...]} for each of `dirs`.
+    '''
+    result = OrderedDict((d, []) for d in dirs)
+    for root, dirpath, filenames, file_types in walk_source_dirs(list(result), max_dir_tree_level, max_workers, cache, rules):
+        result[root].append((dirpath, filenames, file_types))
+    return result
+
+def gather_source_files(dirs :list, more_files :list, grouping :FileGrouping, config :dict, project_dir :str=None, scan_cache :ScanCache=None, scan_results :dict=None, include_cache=None, hash_cache=None) -> dict:
+    '''
+        paths of header files are added to `IncludePaths` of `config`,
+        relative to `project_dir` (defaults to `ProjectDirectory`),
+        see `include_paths` in the config file. duplicate content is
+        reported or excluded, see `duplicate_content`.
+
+        `scan_results` are listings made in advance by `scan_source_dirs()`,
+        as {(absolute dir, max_dir_tree_level): [(dirpath, filenames, file_types), ...]}.
+        directories not found in it are walked here, and files are grouped
+        as their directories are listed (see `walk_source_dirs()` and
+        `GitIndexSource`).
+    '''
+    max_dir_tree_level = config['uvmake']['max_dir_tree_level']
+    scan_threads = config['uvmake'].get('scan_threads')
 
     if not dirs:
         dirs = []
 
+    dirs = [path.normpath(d) for d in dirs]
+    dirs = list(OrderedDict.fromkeys(d for d in dirs if _verify_path(d)))
     for d in dirs:
-        d = path.normpath(d)
-        if not _verify_path(d):
-            continue
         logger.info('Gathering source files in directory: ' + d)
-        base_level = _dir_tree_level(d)
-        for dirpath, dirnames, filenames in os.walk(d):
-            if _dir_tree_level(dirpath) - base_level > max_dir_tree_level:
-                break
-            filenames = [f for f in filenames if UvFileType.of(f) is not None]
-            filepaths = [path.join(dirpath, filename) for filename in filenames] # combine to full path
-            filepaths = _filter_kws(filepaths)
-            if not filenames:
+
+    scanned = dict()
+    if scan_results:
+        for d in dirs:
+            entries = scan_results.get((path.abspath(d), max_dir_tree_level))
+            if entries is not None:
+                scanned[d] = entries
+    _unscanned = [d for d in dirs if not d in scanned]
+
+    def _listings():
+        # listings of `dirs` in order, the unscanned ones as they are walked
+        from itertools import groupby
+        rules = ExcludeRules.from_config(config)
+        if config['uvmake'].get('source_provider', 'WALK') == 'GIT_INDEX':
+            source = GitIndexSource(config['uvmake'].get('git_untracked_files', False), max_workers=scan_threads, cache=scan_cache)
+            walk = source.walk(_unscanned, max_dir_tree_level, rules)
+        else:
+            walk = walk_source_dirs(_unscanned, max_dir_tree_level, max_workers=scan_threads, cache=scan_cache, rules=rules)
+        walk = groupby(walk, key=lambda entry: entry[0])
+        for d in dirs:
+            if d in scanned:
+                yield from scanned[d]
+            else:
+                _, entries = next(walk)
+                yield from (entry[1:] for entry in entries)
+
+    with stats.phase('scan and group'):
+        for dirpath, filenames, file_types in _listings():
+            stats.count('dirs visited')
+            filepaths = _source_filepaths(dirpath, filenames, file_types)
+            if not filepaths:
                 continue
-            logger.debug('Source files found in "{}":'.format(dirpath) + '\n  ' + '\n  '.join(filepaths))
+            logger.debug('Source files found in "%s":%s', dirpath, _lines(filepaths))
             logger.info('  Files gathered: {}'.format(len(filepaths)))
             grouping.gather(filepaths)
+        if scan_cache and (scan_cache.hits or scan_cache.misses):
+            logger.info('Scan cache: {} hits, {} misses'.format(scan_cache.hits, scan_cache.misses))
+            scan_cache.save()
+
+        if more_files:
+            more_files = [path.normpath(f) for f in more_files if _verify_path(f)]
+            grouping.gather(more_files)
+
+    with stats.phase('duplicates'):
+        file_groups = grouping.get(prepare=lambda file_groups: _drop_duplicate_content(file_groups, config, hash_cache, scan_threads))
+    with stats.phase('includes'):
+        _add_include_paths(file_groups, config, project_dir or config['ProjectDirectory'], include_cache, scan_threads)
+    return file_groups
 
-    if more_files:
-        more_files = [path.normpath(f) for f in more_files if _verify_path(f)]
-        grouping.gather(more_files)
-
-    file_groups = grouping.get()
+def _source_filepaths(dirpath :str, filenames :list, file_types :list) -> list:
+    '''
+        returns paths of the source files among `filenames` in `dirpath`
+    '''
+    # other files have no type in a listing (see `UvFileType.classify_many()`),
+    # list them in `SourceFiles` instead.
+    return [path.join(dirpath, f) for f, t in zip(filenames, file_types) if t is not None]
 
+def _add_include_paths(file_groups :FileGroups, config :dict, project_dir :str, include_cache=None, max_workers=None):
     # add the paths to header files into 'IncludePaths'
     propts = config['ProjectOptions']
     if not propts['IncludePaths']:
         propts['IncludePaths'] = []
-    for g in file_groups:
-        for f in file_groups[g]:
-            if UvFileType.is_header(str(f)):
-                # make the path relative to project directory
-                f = path.relpath(f, start=config['ProjectDirectory'])
-                f = path.dirname(f)
-                if not f in propts['IncludePaths']:
-                   propts['IncludePaths'].append(f)
+    if config['uvmake'].get('include_paths', 'ALL') == 'USED':
+        header_dirs, reached = scan_includes(file_groups, max_workers=max_workers, cache=include_cache)
+        if config['uvmake'].get('drop_unused_headers', False):
+            _drop_headers(file_groups, reached)
+    else:
+        header_dirs = OrderedDict()
+        for g in file_groups:
+            for r in file_groups.records(g):
+                if r.ext == '.h':
+                    header_dirs[r.dirpath] = None
+    _known = set(propts['IncludePaths'])
+    for d in header_dirs:
+        # make the path relative to project directory
+        d = _win_relpath(d, project_dir)
+        if not d in _known:
+            _known.add(d)
+            propts['IncludePaths'].append(d)
+
+_include_re = re.compile(rb'^[ \t]*#[ \t]*include[ \t]*([<"])([^>"\r\n]+)[>"]', re.M)
+
+def _read_includes(filepath :str) -> list:
+    '''
+        returns [[quoted, name], ...] for `#include` directives in `filepath`,
+        `quoted` is True for `#include "name"`.
+    '''
+    try:
+        with open(filepath, 'rb') as f:
+            content = f.read()
+    except OSError as e:
+        logger.warning('Cannot read "{}": {}'.format(filepath, e))
+        return []
+    return [[m.group(1) == b'"', m.group(2).strip().decode('UTF-8', 'replace')] for m in _include_re.finditer(content)]
+
+class IncludeCache(FileCache):
+    '''
+        cache of `#include` directives found by `_read_includes()`.
+    '''
+    name = 'include cache'
 
-    return file_groups
+    def read_includes(self, filepath :str) -> list:
+        return self.lookup(filepath, 'includes', _read_includes)
+
+class HashCache(FileCache):
+    '''
+        cache of SHA-256 digests of file content.
+    '''
+    name = 'hash cache'
+
+    def digest(self, filepath :str) -> str:
+        return self.lookup(filepath, 'sha256', _file_digest)
+
+def find_duplicate_content(file_groups :FileGroups, max_workers=None, cache :HashCache=None) -> OrderedDict:
+    '''
+        find byte-identical copies among compiled files and libraries of
+        `file_groups`. files are bucketed by size, only files sharing a size
+        are read (concurrently, through `cache` if given).
+
+        returns {index of a copy: index of the file gathered first}.
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+    digest = cache.digest if cache else _file_digest
+    _linked = UvFileType.COMPILED + (UvFileType.OBJECT, UvFileType.LIB)
+    records = [r for g in file_groups for r in file_groups.records(g) if r.type in _linked]
+
+    def _size(filepath):
+        try:
+            return os.stat(filepath).st_size
+        except OSError:
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        sizes = list(executor.map(_size, [r.abspath for r in records]))
+        _count = dict()
+        for size in sizes:
+            _count[size] = _count.get(size, 0) + 1
+        candidates = [(r, size) for r, size in zip(records, sizes) if size is not None and _count[size] > 1]
+        digests = list(executor.map(digest, [r.abspath for r, _ in candidates]))
+    stats.count('files hashed', len(candidates))
+
+    first = dict() # (size, digest) -> index
+    duplicates = OrderedDict()
+    for (r, size), d in zip(candidates, digests):
+        kept = first.setdefault((size, d), r.index)
+        if kept != r.index:
+            duplicates[r.index] = kept
+    return duplicates
+
+def _drop_duplicate_content(file_groups :FileGroups, config :dict, cache :HashCache=None, max_workers=None):
+    # report or exclude duplicate content, see `duplicate_content` in the config file
+    policy = config['uvmake'].get('duplicate_content', 'IGNORE')
+    if policy == 'IGNORE':
+        return
+    if not policy in ('REPORT', 'EXCLUDE'):
+        raise ConfigError('Invalid value for `duplicate_content`: {}'.format(policy))
+    duplicates = find_duplicate_content(file_groups, max_workers=max_workers, cache=cache)
+    if cache and cache.filepath:
+        logger.info('Hash cache: {} hits, {} misses'.format(cache.hits, cache.misses))
+        cache.save()
+    stats.count('duplicate contents', len(duplicates))
+    table = file_groups.table
+    for i, kept in duplicates.items():
+        _same = '"{}" (same as "{}")'.format(table[i].abspath, table[kept].abspath)
+        if policy == 'EXCLUDE':
+            logger.info('Excluded duplicate content: ' + _same)
+        else:
+            logger.warning('Duplicate content: ' + _same)
+    if policy == 'EXCLUDE' and duplicates:
+        for g in list(file_groups):
+            kept = [i for i in file_groups.groups[g] if not i in duplicates]
+            if kept:
+                file_groups.groups[g] = kept
+            else:
+                del file_groups[g]
+
+def scan_includes(file_groups :FileGroups, max_workers=None, cache :IncludeCache=None):
+    '''
+        follow `#include` directives from the gathered source files, through
+        the gathered headers they reach.
+
+        returns (header_dirs, reached). `header_dirs` are the directories of
+        gathered headers that must be in `IncludePaths`, in the order the
+        headers are gathered. `reached` is the set of headers included.
+
+        an included name is resolved against the directory of the including
+        file first (for `#include "..."`), then against gathered headers
+        whose path ends with it. if several do, the one sharing the longest
+        path with the including file wins. names found nowhere (e.g. headers
+        of Keil) are ignored.
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+    read_includes = cache.read_includes if cache else _read_includes
+
+    _records = [r for g in file_groups for r in file_groups.records(g)]
+    _files = [r.abspath for r in _records]
+    headers = [r.abspath for r in _records if r.ext == '.h']
+    _headers = {path.normcase(path.normpath(h)): h for h in headers}
+    # file name -> gathered headers of that name
+    _by_name = dict()
+    for h in headers:
+        _by_name.setdefault(path.normcase(path.basename(h)), []).append(h)
+
+    def _resolve(including :str, quoted :bool, name :str):
+        # returns (header, directory needed in `IncludePaths` or None)
+        name = path.normpath(name.replace('\\', '/').replace('/', os.sep))
+        if quoted:
+            h = _headers.get(path.normcase(path.join(path.dirname(including), name)))
+            if h:
+                return h, None
+        _suffix = path.normcase(os.sep + name)
+        candidates = [h for h in _by_name.get(path.normcase(path.basename(name)), []) \
+            if path.normcase(os.sep + h).endswith(_suffix)]
+        if not candidates:
+            return None, None
+        if len(candidates) > 1:
+            _common = lambda h: len(path.commonpath([path.dirname(h), path.dirname(including)])) \
+                if path.splitdrive(h)[0] == path.splitdrive(including)[0] else 0
+            candidates.sort(key=lambda h: (-_common(h), h))
+        h = candidates[0]
+        return h, h[:len(h) - len(name)].rstrip('/\\') or os.sep
+
+    needed, reached = set(), set()
+    # by extension, C files built through unity files are not typed as C
+    pending = [r.abspath for r in _records if r.ext == '.c' or r.ext == '.cpp']
+    visited = set(pending)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending:
+            _next = []
+            for f, includes in zip(pending, executor.map(read_includes, pending)):
+                for quoted, name in includes:
+                    h, d = _resolve(f, quoted, name)
+                    if h is None:
+                        continue
+                    reached.add(h)
+                    if d:
+                        needed.add(d)
+                    if not h in visited:
+                        visited.add(h)
+                        _next.append(h)
+            pending = _next
+    if cache and cache.filepath:
+        logger.info('Include cache: {} hits, {} misses'.format(cache.hits, cache.misses))
+        cache.save()
+    stats.count('headers reached', len(reached))
+
+    header_dirs = OrderedDict()
+    for h in headers:
+        d = path.dirname(h)
+        if d in needed:
+            header_dirs[d] = None
+    # directories above gathered headers, needed by names like "sub/x.h"
+    for d in sorted(needed - header_dirs.keys()):
+        header_dirs[d] = None
+    return header_dirs, reached
+
+def _drop_headers(file_groups :FileGroups, reached :set):
+    # remove gathered headers not included by any source file
+    for g in list(file_groups):
+        kept = []
+        for r in file_groups.records(g):
+            if r.ext == '.h' and not r.abspath in reached:
+                logger.info('Dropped unused header: "{}"'.format(r.abspath))
+            else:
+                kept.append(r.index)
+        if kept:
+            file_groups.groups[g] = kept
+        else:
+            del file_groups[g]
+
+def make_grouping(config :dict, project_dir :str=None, readonly=False) -> FileGrouping:
+    '''
+        `project_dir` defaults to `ProjectDirectory`. with `readonly`, no
+        file is made by the grouping. unity files left by 'UNITY_BY_FOLDER'
+        are removed with other methods.
+    '''
+    _gm = config['uvmake']['file_grouping_method']
+    unity_dir = path.join(project_dir or config['ProjectDirectory'], config['uvmake'].get('unity_directory', 'Unity'))
+    if   _gm == 'NONE':
+        grouping = FileGroupingNone(config)
+    elif _gm == 'C_BY_FOLDER':
+        grouping = FileGroupingCByFolder(config)
+    elif _gm == 'ALL_BY_FOLDER':
+        grouping = FileGroupingAllByFolder(config)
+    elif _gm == 'UNITY_BY_FOLDER':
+        return FileGroupingUnityByFolder(config, unity_dir, readonly=readonly)
+    else:
+        raise ConfigError('Unknown grouping method: {}. Please check the config file.'.format(str(_gm)))
+    # unity files made with 'UNITY_BY_FOLDER' before, not to be gathered
+    unity = FileGroupingUnityByFolder(config, unity_dir, readonly=readonly)
+    unity._remove_stale(set())
+    grouping.up_to_date = unity.up_to_date
+    return grouping
+
+class UvProject():
+    '''
+        a Keil C51 project, configured by `config` (see `get_config_template()`).
+
+        relative paths in `config` are resolved against `base_dir`, the current
+        directory by default, the working directory of the process is never
+        changed. errors are raised as `UvMakeError`. projects share no state,
+        so different projects can be configured from different threads.
+
+        files kept by uvmake (scan cache, fingerprint, config snapshot) are
+        put next to `config_file`, nothing is kept without it.
+    '''
+    def __init__(self, config :dict, config_file :str=None, base_dir :str=None, backup=True, check=False, rescan=False):
+        self.config = config
+        self.config_file = path.abspath(config_file) if config_file else None
+        self.base_dir = path.abspath(base_dir or os.getcwd())
+        self.backup = backup
+        self.check = check
+        self.rescan = rescan
+
+    @classmethod
+    def load(cls, config_file :str, base_dir :str=None, snapshot=False, **options):
+        '''
+            with `snapshot`, the config is loaded from a snapshot of it while the
+            config file is unchanged (see `load_config()`), which is faster
+            but loses comments. don't use it for `reverse_config()`.
+        '''
+        snapshot_file = config_file + '.snapshot' if snapshot else None
+        with stats.phase('load config'):
+            config = load_config(config_file, snapshot_file, readonly=options.get('check', False))
+        return cls(config, config_file=config_file, base_dir=base_dir, **options)
+
+    def resolve(self, p :str) -> str:
+        return path.normpath(path.join(self.base_dir, _host_path(p)))
+
+    @property
+    def project_dir(self) -> str:
+        return self.resolve(self.config['ProjectDirectory'])
+
+    @property
+    def project_name(self) -> str:
+        return self.config['ProjectName']
+
+    def _kept_file(self, suffix :str):
+        return self.config_file + suffix if self.config_file else None
+
+    def merge_args(self, args):
+        merge_args(self.config, args)
+
+    def gather(self, grouping :FileGrouping=None, scan_results :dict=None) -> dict:
+        '''
+            gather source files into file groups, with absolute paths.
+        '''
+        grouping = grouping or make_grouping(self.config, self.project_dir, readonly=self.check)
+
+        scan_cache, include_cache, hash_cache = None, None, None
+        if self.config['uvmake'].get('scan_cache', True) and self.config_file:
+            if scan_results is None: # else it's kept by `_batch_scan()`
+                scan_cache = ScanCache(self._kept_file('.scancache'), rescan=self.rescan, readonly=self.check)
+            if self.config['uvmake'].get('include_paths', 'ALL') == 'USED':
+                include_cache = IncludeCache(self._kept_file('.includecache'), rescan=self.rescan, readonly=self.check)
+            if self.config['uvmake'].get('duplicate_content', 'IGNORE') != 'IGNORE':
+                hash_cache = HashCache(self._kept_file('.hashcache'), rescan=self.rescan, readonly=self.check)
+
+        return gather_source_files( \
+            [self.resolve(d) for d in (self.config['SourceDirectories'] or [])],
+            [self.resolve(f) for f in (self.config['SourceFiles'] or [])],
+            grouping,
+            self.config,
+            project_dir=self.project_dir,
+            scan_cache=scan_cache,
+            scan_results=scan_results,
+            include_cache=include_cache,
+            hash_cache=hash_cache
+            )
+
+    def make(self, file_groups :dict, backup :bool=None, preload :TemplatePreload=None) -> bool:
+        '''
+            write `file_groups` and options into project files, and library
+            projects if `lib_shards` is set.
+            returns True if project files are up to date.
+        '''
+        _make = make_project if self.config['uvmake'].get('lib_shards', 'NONE') == 'NONE' else make_sharded_project
+        return _make(
+            self.project_dir,
+            self.project_name,
+            file_groups,
+            self.config,
+            backup=self.backup if backup is None else backup,
+            fingerprint_file=self._kept_file('.fingerprint'),
+            check=self.check,
+            preload=preload
+            )
+
+    def configure(self, scan_results :dict=None) -> bool:
+        '''
+            gather source files and update project files.
+            returns True if project files are up to date.
+
+            project files are parsed while source files are gathered, unless
+            there is only one CPU to take turns on.
+        '''
+        preload = None
+        if not self.check and (os.cpu_count() or 1) > 1:
+            _base = path.join(self.project_dir, self.project_name)
+            preload = TemplatePreload([_base + '.uvproj', _base + '.uvopt'], self.config)
+        grouping = make_grouping(self.config, self.project_dir, readonly=self.check)
+        try:
+            up_to_date = self.make(self.gather(grouping, scan_results=scan_results), preload=preload)
+        finally:
+            if preload:
+                preload.cancel() # not used if project files are up to date
+        return up_to_date and grouping.up_to_date
+
+    def reverse_config(self):
+        '''
+            update the config (and config file) according to project files.
+        '''
+        reverse_config(self.config, self.project_dir)
+        if self.config_file:
+            _dump_config(self.config, self.config_file)
+            logger.info('Config file updated.')
+
+    def restore(self, generation :int=None):
+        '''
+            restore project files from a backup generation, the latest by
+            default (option `--restore`). the current files are backed up first.
+        '''
+        project_dir = self.project_dir
+        with ProjectLock(project_dir):
+            store = BackupStore(project_dir, self.config['uvmake'].get('backup_generations', 10))
+            target = store.find(generation)['id']
+            current = [path.join(project_dir, name) for name in store.find(target)['files']]
+            store.backup([f for f in current if path.exists(f)], evict=False)
+            store.restore(target)
+            store.evict()
+            store._save()
+
+    def watch(self, interval=1.0):
+        '''
+            keep project files up to date until interrupted (option `--watch`).
+        '''
+        backup = [self.backup]
+
+        def _on_change(file_groups):
+            self.make(file_groups, backup=backup[0])
+            backup[0] = False # backup only once per session
+
+        SourceWatcher(self, interval=interval).watch(_on_change)
+
+class SourceWatcher():
+    '''
+        keeps project files in sync with `SourceDirectories` and `SourceFiles`
+        (option `--watch`).
+
+        directories are polled by mtime, which changes whenever a file in it is
+        added, deleted or renamed. with package `watchdog` installed, file system
+        events wake the poller up immediately. only changed directories are
+        listed again, and the files are added to or removed from the one
+        `FileGrouping` kept in memory.
+    '''
+    def __init__(self, project :UvProject, interval=1.0, debounce=0.5):
+        config = project.config
+        self.project = project
+        self.grouping = make_grouping(config, project.project_dir)
+        self.interval = interval
+        self.debounce = debounce
+        self.rules = ExcludeRules.from_config(config)
+        self.max_dir_tree_level = config['uvmake']['max_dir_tree_level']
+        self.dirs = [project.resolve(d) for d in (config['SourceDirectories'] or [])]
+        self.dirs = [d for d in self.dirs if _verify_path(d)]
+        self.more_files = [project.resolve(f) for f in (config['SourceFiles'] or [])]
+        self.include_paths = list(config['ProjectOptions']['IncludePaths'] or [])
+        self.include_cache = IncludeCache(None) # `#include` directives of files seen
+        self.hash_cache = HashCache(None)       # digests of files seen
+        self._dirs = dict()       # dirpath -> [mtime, level, source file paths, subdirectory paths, context of `rules`]
+        self._more_files = dict() # file path -> exists
+        self._wakeup = threading.Event()
+
+    def _stat(self, p):
+        try:
+            return os.stat(p).st_mtime_ns
+        except OSError:
+            return None
+
+    def _list(self, d :str, context :tuple):
+        filenames, file_types, dirnames, subcontext = self.rules.apply(d, *_list_dir(d), context)
+        return _source_filepaths(d, filenames, file_types), dirnames, subcontext
+
+    def _add_tree(self, d :str, level :int, context :tuple):
+        mtime = self._stat(d)
+        filepaths, dirnames, subcontext = self._list(d, context)
+        subdirs = [path.join(d, sub) for sub in dirnames] if level < self.max_dir_tree_level else []
+        self._dirs[d] = [mtime, level, filepaths, subdirs, context]
+        self.grouping.gather(filepaths)
+        for sub in subdirs:
+            self._add_tree(sub, level + 1, subcontext)
+
+    def _remove_tree(self, d :str):
+        _state = self._dirs.pop(d, None)
+        if _state is None:
+            return
+        for f in _state[2]:
+            self.grouping.remove(f)
+        for sub in _state[3]:
+            self._remove_tree(sub)
+
+    def _update_dir(self, d :str):
+        mtime, level, old_files, old_subdirs, context = self._dirs[d]
+        mtime = self._stat(d)
+        if mtime is None:
+            logger.info('Directory removed: ' + d)
+            self._remove_tree(d)
+            return
+        filepaths, dirnames, subcontext = self._list(d, context)
+        _new, _old = set(filepaths), set(old_files)
+        for f in old_files:
+            if not f in _new:
+                logger.info('File removed: ' + f)
+                self.grouping.remove(f)
+        added = [f for f in filepaths if not f in _old]
+        for f in added:
+            logger.info('File added: ' + f)
+        self.grouping.gather(added)
+
+        subdirs = [path.join(d, sub) for sub in dirnames] if level < self.max_dir_tree_level else []
+        for sub in old_subdirs:
+            if not sub in subdirs:
+                self._remove_tree(sub)
+        self._dirs[d] = [mtime, level, filepaths, subdirs, context]
+        for sub in subdirs:
+            if not sub in old_subdirs:
+                self._add_tree(sub, level + 1, subcontext)
+
+    def _changed_dirs(self) -> list:
+        return [d for d, _state in self._dirs.items() if self._stat(d) != _state[0]]
+
+    def _changed_files(self) -> list:
+        return [f for f, exists in self._more_files.items() if path.exists(f) != exists]
+
+    def _update_more_files(self):
+        for f in self.more_files:
+            exists = path.exists(f)
+            if self._more_files.get(f) == exists:
+                continue
+            self._more_files[f] = exists
+            if exists:
+                self.grouping.gather([f])
+            else:
+                self.grouping.remove(f)
+
+    def file_groups(self) -> dict:
+        config = self.project.config
+        file_groups = self.grouping.get(
+            prepare=lambda file_groups: _drop_duplicate_content(file_groups, config, self.hash_cache, config['uvmake'].get('scan_threads'))
+            )
+        config['ProjectOptions']['IncludePaths'] = list(self.include_paths)
+        _add_include_paths(file_groups, config, self.project.project_dir, self.include_cache, config['uvmake'].get('scan_threads'))
+        return file_groups
+
+    def _start_observer(self):
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            logger.info('Package `watchdog` not installed, polling every {} s'.format(self.interval))
+            return None
+
+        _wakeup = self._wakeup
+        class _Handler(FileSystemEventHandler):
+            def on_any_event(self, event):
+                _wakeup.set()
+
+        observer = Observer()
+        for d in self.dirs:
+            observer.schedule(_Handler(), d, recursive=True)
+        for d in OrderedDict.fromkeys(path.dirname(path.abspath(f)) for f in self.more_files):
+            if path.isdir(d):
+                observer.schedule(_Handler(), d, recursive=False)
+        observer.start()
+        return observer
+
+    def watch(self, on_change):
+        '''
+            call `on_change(file_groups)` once for the current files,
+            then whenever the file groups change. runs until interrupted.
+            a `UvMakeError` is logged, and the next change tries again.
+        '''
+        import time
+
+        def _rebuild(last_groups):
+            # returns the file groups project files are made of
+            try:
+                file_groups = self.file_groups()
+                if file_groups == last_groups:
+                    logger.debug('No change in file groups.')
+                    return last_groups
+                on_change(file_groups)
+                return file_groups
+            except UvMakeError as e:
+                logger.error('{} (retrying on the next change)'.format(e))
+                logger.debug(traceback.format_exc())
+                return last_groups
+
+        for d in self.dirs:
+            if not d in self._dirs:
+                self._add_tree(d, 0, self.rules.context(d))
+        self._update_more_files()
+        last_groups = _rebuild(None)
+
+        observer = self._start_observer()
+        logger.info('Watching for changes, press Ctrl-C to stop.')
+        try:
+            while True:
+                self._wakeup.wait(self.interval)
+                if not (self._wakeup.is_set() or self._changed_dirs() or self._changed_files()):
+                    continue
+                # wait for a burst of changes to settle down
+                while True:
+                    self._wakeup.clear()
+                    time.sleep(self.debounce)
+                    if not self._wakeup.is_set():
+                        break
+                for d in self._changed_dirs():
+                    if d in self._dirs:
+                        self._update_dir(d)
+                self._update_more_files()
+                last_groups = _rebuild(last_groups)
+        except KeyboardInterrupt:
+            logger.info('Stopped watching.')
+        finally:
+            if observer:
+                observer.stop()
+                observer.join()
+
+def _batch_config_files(items :list) -> list:
+    '''
+        expand `items` of option `--batch` into config file paths.
+        an item is either a glob pattern of config files, or a manifest file
+        listing config files (or glob patterns) line by line, relative to itself.
+    '''
+    from glob import glob
+    config_files = []
+    for item in items:
+        if path.isfile(item) and not item.endswith(('.yaml', '.yml')):
+            _base = path.dirname(item)
+            with open(item, encoding='UTF-8') as f:
+                for line in f:
+                    line = line.split('#', 1)[0].strip()
+                    if line:
+                        config_files.extend(sorted(glob(path.join(_base, line))) or [path.join(_base, line)])
+        else:
+            config_files.extend(sorted(glob(item)) or [item])
+    return [*OrderedDict.fromkeys(path.abspath(f) for f in config_files)]
+
+def _batch_scan(projects :list) -> dict:
+    '''
+        scan `SourceDirectories` of all `projects` at once, so directories
+        shared between projects are listed only once, through the scan caches
+        of all of them. the scan caches are updated here.
+        returns {config file: scan results}, see `gather_source_files()`.
+    '''
+    _projects = OrderedDict() # config file -> [(absolute dir, max_dir_tree_level, rules key), ...]
+    _dirs = OrderedDict()     # (max_dir_tree_level, rules key) -> [absolute dir, ...]
+    _threads = dict()         # (max_dir_tree_level, rules key) -> `scan_threads`
+    _rules = dict()           # rules key -> `ExcludeRules`
+    _caches = OrderedDict()   # config file -> `ScanCache`
+    shared = ScanCache(None)  # looks up the entries of all `_caches`
+    for project in projects:
+        _uvmake = project.config['uvmake']
+        try:
+            if _uvmake.get('source_provider', 'WALK') == 'GIT_INDEX':
+                continue # listed from the git index by the worker
+            level = _uvmake['max_dir_tree_level']
+            rules = ExcludeRules.from_config(project.config)
+            keys = [(project.resolve(d), level, rules.key) for d in (project.config['SourceDirectories'] or [])]
+        except:
+            continue # reported by the worker
+        _rules[rules.key] = rules
+        keys = [k for k in keys if path.isdir(k[0])]
+        _projects[project.config_file] = keys
+        if _uvmake.get('scan_cache', True):
+            cache = _caches[project.config_file] = ScanCache(project._kept_file('.scancache'), rescan=project.rescan, readonly=project.check)
+            shared.merge(cache)
+        for d, level, rules_key in keys:
+            _dirs.setdefault((level, rules_key), [])
+            if not d in _dirs[(level, rules_key)]:
+                _dirs[(level, rules_key)].append(d)
+            if _uvmake.get('scan_threads'):
+                _threads[(level, rules_key)] = max(_threads.get((level, rules_key), 0), _uvmake['scan_threads'])
+
+    _listings = dict()
+    for (level, rules_key), dirs in _dirs.items():
+        _scanned = scan_source_dirs(dirs, level, max_workers=_threads.get((level, rules_key)), cache=shared, rules=_rules[rules_key])
+        for d, entries in _scanned.items():
+            _listings[(d, level, rules_key)] = entries
+    if shared.hits or shared.misses:
+        logger.info('Scan cache: {} hits, {} misses'.format(shared.hits, shared.misses))
+    for config_file, cache in _caches.items():
+        cache.take(shared, [dirpath for k in _projects[config_file] for dirpath, _, _ in _listings[k]])
+        cache.save()
+    return {f: {k[:2]: _listings[k] for k in keys} for f, keys in _projects.items()}
+
+def _batch_project(config_file :str, args, config :dict=None) -> UvProject:
+    # paths in a config file of a batch are relative to the config file
+    options = dict(base_dir=path.dirname(config_file), backup=not args.no_backup, check=args.check, rescan=args.rescan)
+    if config is not None:
+        return UvProject(config, config_file=config_file, **options)
+    return UvProject.load(config_file, snapshot=not args.rescan, **options)
+
+def _batch_worker(job):
+    '''
+        configure one project of a batch, in a worker process.
+        returns (config file, status, seconds, stats) with status 'OK', 'STALE'
+        or 'FAILED', and stats as `Stats.as_dict()` if enabled.
+    '''
+    import time
+    config_file, config, args, scan_results = job
+    t = time.perf_counter()
+    status = 'FAILED'
+    if args.profile or args.profile_out or args.stats_json:
+        stats.reset()
+        stats.enable()
+    try:
+        project = _batch_project(config_file, args, config)
+        project.merge_args(args)
+        status = 'OK' if project.configure(scan_results) else ('STALE' if args.check else 'FAILED')
+    except UvMakeError as e:
+        logger.error('{} (in "{}")'.format(e, config_file))
+        logger.debug(traceback.format_exc())
+    except:
+        logger.error('Error occurred in "{}"'.format(config_file))
+        logger.debug(traceback.format_exc())
+    return config_file, status, time.perf_counter() - t, stats.as_dict() if stats.enabled else None
+
+def run_batch(items :list, args) -> int:
+    '''
+        configure all projects given by option `--batch` in a process pool.
+        returns the exit code, non-zero if any project failed (or is out of
+        date, with option `--check`).
+    '''
+    from concurrent.futures import ProcessPoolExecutor
+    config_files = _batch_config_files(items)
+    if not config_files:
+        logger.error('No config file found for batch: ' + ' '.join(items))
+        return -1
+    logger.info('Batch of {} projects'.format(len(config_files)))
+    for f in config_files:
+        if not path.exists(f):
+            logger.error('Config file not exist: ' + f)
+            return -1
+
+    # configs are loaded once, here, and handed to the workers
+    projects = []
+    for f in config_files:
+        try:
+            projects.append(_batch_project(f, args))
+        except UvMakeError:
+            pass # reported by the worker
+    configs = {p.config_file: _plain(p.config) for p in projects}
+    scan_results = _batch_scan(projects)
+    results = []
+    with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+        _jobs = [(f, configs.get(path.abspath(f)), args, scan_results.get(path.abspath(f))) for f in config_files]
+        for result in executor.map(_batch_worker, _jobs):
+            results.append(result)
+            if result[3]:
+                stats.merge(result[3])
+
+    _cwd = os.getcwd()
+    logger.info('Batch summary:')
+    for config_file, status, seconds, _ in results:
+        logger.info('  {:<7} {}  ({:.2f} s)'.format(status, path.relpath(config_file, _cwd), seconds))
+    _failed = [r for r in results if r[1] != 'OK']
+    logger.info('{} of {} projects OK'.format(len(results) - len(_failed), len(results)))
+    return 1 if _failed else 0
 
 if __name__ == '__main__':
 
     args = shell_interface()
 
     if args.config_template:
-        make_config_template_file()
+        make_config_template_file(args.config_file)
         exit()
     if args.debug:
         logger.setLevel(logging.DEBUG)
-    if not path.exists(args.config_file) and not args.reverse_config:
+    if args.profile_out and path.splitext(args.profile_out)[1].lower() in ('.yaml', '.yml'):
+        logger.error('Refusing to write profile stats into config file: ' + args.profile_out)
+        sys.exit(2)
+    if args.profile or args.profile_out or args.stats_json:
+        _enable_stats(args.profile, args.profile_out, args.stats_json)
+    if args.batch:
+        sys.exit(run_batch(args.batch, args))
+    reverse = args.reverse_config or args.update_config
+    if not path.exists(args.config_file) and not reverse:
         logger.error(args.config_file + '  not exist. run with `-h` to get help information')
         exit()
     if not path.exists(args.config_file):
-        make_config_template_file()
-    
-    load_config()
-    merge_args(args)
+        make_config_template_file(args.config_file)
 
-    # now, config file exists and loaded.
-    if args.reverse_config:
-        reverse_config()
-        sys.exit(0)
+    try:
+        project = UvProject.load(
+            args.config_file,
+            snapshot=not (reverse or args.rescan),
+            backup=not args.no_backup,
+            check=args.check,
+            rescan=args.rescan
+            )
+        project.merge_args(args)
 
-    backup = False if args.no_backup else True
-    
-    _gm = config['uvmake']['file_grouping_method']
-    if   _gm == 'NONE':
-        grouping = FileGroupingNone()
-    elif _gm == 'C_BY_FOLDER':
-        grouping = FileGroupingCByFolder()
-    elif _gm == 'ALL_BY_FOLDER':
-        grouping = FileGroupingAllByFolder()
-    else:
-        logger.error('Unknown grouping method: {}. Please check the config file.'.format(str(_gm)))
-        sys.exit(-1)
+        # now, config file exists and loaded.
+        if args.restore is not None:
+            project.restore(args.restore or None)
+            sys.exit(0)
 
-    file_groups = gather_source_files( \
-        config['SourceDirectories'],
-        config['SourceFiles'],
-        grouping
-        )
-    # yaml.dump(file_groups, stream=sys.stdout)
+        if reverse:
+            project.reverse_config()
+            sys.exit(0)
 
-    make_project(
-        config['ProjectDirectory'],
-        config['ProjectName'],
-        file_groups,
-        backup=backup
-        )
+        if args.watch:
+            project.watch(interval=args.watch)
+            sys.exit(0)
+
+        up_to_date = project.configure()
+    except UvMakeError as e:
+        logger.error(str(e))
+        logger.debug(traceback.format_exc())
+        sys.exit(-1)
+
+    if args.check:
+        sys.exit(0 if up_to_date else 1)
 
     logger.info('All done.')